@@ -0,0 +1,539 @@
+import math
+import random
+from ai_worker import likely_moves
+from alpha_beta_pruning import alpha_beta
+from constants import Player
+from iterative_deepening import (
+    SearchLimits,
+    SearchTimeout,
+    deepen,
+    iterative_deepening,
+)
+from minimax import minimax
+from move_ordering import MoveOrderer
+from parallel_search import parallel_search_turn
+from powerups import POWER_UPS, PowerUps
+from pvs import ASPIRATION, pvs
+from transposition import TranspositionTable
+
+SWAP_SAMPLES = 12  # Most random Swap Token outcomes searched for one decision
+SWAP_MIN_SAMPLES = 3  # Outcomes searched before the decision may be called settled
+SWAP_CONFIDENCE = 1.96  # Standard errors the mean must be clear by (95%)
+SWAP_SHARE = 0.5  # Share of the turn's budget the sampling gets on top
+
+
+def swap_outcome(game, move):
+    """
+    This function returns a copy of game after the AI spends its token on
+    Swap Token and draws move, played on through the power token rules (see
+    powerups.PowerUps): each of the player's next two lines is followed by a
+    random line, with the player keeping the turn
+    Every line up to the second random one is taken to be the mover's likeliest
+    (see ai_worker.likely_moves), so the player is to move in the copy unless
+    the game is over
+    """
+    ng = game.clone()
+    rules = PowerUps()
+    rules.use(ng, Player.AI, "Swap Token")
+    rules.play(ng, move)
+
+    while rules.swap_count > 0 and not ng.is_terminal():
+        rules.play(ng, ng.geometry.line_moves[likely_moves(ng, 1)[0]])
+
+    return ng
+
+
+def search_position(
+    game, depth, algo_choice="alpha-beta", table=None, limits=None, ordering=None
+):
+    """
+    This function returns the value of game from the AI's point of view,
+    searched to depth by algo_choice whichever side is to move; game is
+    searched in place
+    """
+    maximizing = game.current_player == Player.AI
+
+    if algo_choice == "pvs":
+        value, _ = pvs(
+            game, depth, in_place=True, table=table, limits=limits, ordering=ordering
+        )
+
+        return value
+    if algo_choice == "alpha-beta":
+        value, _ = alpha_beta(
+            game,
+            depth,
+            -float("inf"),
+            float("inf"),
+            maximizing,
+            in_place=True,
+            table=table,
+            limits=limits,
+            ordering=ordering,
+        )
+
+        return value
+
+    return minimax(game, depth, maximizing, True, limits)[0]
+
+
+def can_swap(game, use_power=True):
+    return (
+        use_power
+        and game.power_tokens[Player.AI] >= 1
+        and not game.power_used_this_turn
+        and len(game.free_lines) > 2
+    )
+
+
+def root_alternatives(game, use_power=True):
+    """
+    This function returns the ways the AI can start its turn as a list of
+    (power-up, position, keeps_turn): no power-up first, then every power-up
+    the AI can use, each applied to its own copy of the game
+    keeps_turn means the AI draws another line after this one (Extra Move)
+    Swap Token is left out: its random lines are only drawn later in the game,
+    so there is no position to search for it (sample_swap weighs it instead)
+    """
+    alternatives = [(None, game.clone(), False)]
+
+    if not use_power or game.power_tokens[Player.AI] < 1 or game.power_used_this_turn:
+        return alternatives
+
+    for action in POWER_UPS:
+        if action == "Swap Token":
+            continue
+
+        ng = game.clone()
+
+        if action == "Line Reversal":
+            if not ng.last_move or ng.lines.get(ng.last_move) == Player.AI:
+                continue
+            del ng.lines[ng.last_move]
+
+        ng.power_tokens[Player.AI] -= 1
+        ng.power_used_this_turn = True
+        alternatives.append((action, ng, action == "Extra Move"))
+
+    return alternatives
+
+
+def search_turn(
+    alternatives,
+    depth,
+    algo_choice="alpha-beta",
+    table=None,
+    limits=None,
+    ordering=None,
+    first=None,
+    stats=None,
+    window=None,
+):
+    """
+    This function searches every root alternative in one pass and returns
+    (value, power-up, move) for the best line of the best alternative
+    All alternatives share one alpha, so each is only searched until it is
+    clear it does not beat the best line found so far
+    The power-ups (usually the strongest lines) go first to raise alpha early;
+    playing without one goes last with alpha one point lower (values are whole
+    boxes), so it still wins ties and a power-up has to be strictly better
+    first is a (power-up, line) pair to try first, e.g. the last iteration's best
+    With "pvs" every line after the first is only scouted with a null window,
+    and window is the (alpha, beta) the root is searched in: if no line beats
+    alpha the move is None and the value only a bound, and a line that reaches
+    beta ends the search with its value a bound too (see deepen_turn)
+    """
+    alpha, beta = window or (-float("inf"), float("inf"))
+    best_value, best_action, best_line = alpha, None, None
+    if stats is not None:
+        stats.node(depth)
+
+    for action, position, keeps_turn in alternatives[1:] + alternatives[:1]:
+        tie = action is None  # Whether this alternative still wins a tie
+        moves = position.legal_lines()
+        hint = first[1] if first is not None and first[0] == action else None
+        if ordering is not None:
+            moves = ordering.order(position, moves, depth, hint)
+        elif hint in moves:
+            moves.remove(hint)
+            moves.insert(0, hint)
+
+        for line in moves:
+            undo = position.play(line)
+            if keeps_turn and not position.is_terminal():
+                position.current_player = Player.AI
+            maximizing = position.current_player == Player.AI
+
+            floor = best_value - 1 if tie else best_value
+            if algo_choice == "pvs":
+                scout = best_line is not None
+                value, _ = pvs(
+                    position,
+                    depth - 1,
+                    floor,
+                    floor + 1 if scout else beta,
+                    True,
+                    table,
+                    limits,
+                    ordering,
+                    stats=stats,
+                )
+                if scout and floor < value < beta:
+                    value, _ = pvs(
+                        position,
+                        depth - 1,
+                        value,
+                        beta,
+                        True,
+                        table,
+                        limits,
+                        ordering,
+                        stats=stats,
+                    )
+            elif algo_choice == "alpha-beta":
+                value, _ = alpha_beta(
+                    position,
+                    depth - 1,
+                    floor,
+                    beta,
+                    maximizing,
+                    in_place=True,
+                    table=table,
+                    limits=limits,
+                    ordering=ordering,
+                    stats=stats,
+                )
+            else:
+                value, _ = minimax(position, depth - 1, maximizing, True, limits, stats)
+
+            position.undo_move(undo)
+
+            if value > best_value or (tie and value == best_value):
+                best_value, best_action, best_line = value, action, line
+                tie = False
+
+            if best_value >= beta:
+                break
+
+        if best_value >= beta:
+            break
+
+    if best_line is None:
+        return best_value, None, None
+
+    geo = alternatives[0][1].geometry
+
+    return best_value, best_action, geo.line_moves[best_line]
+
+
+def aspiration_turn(alternatives, depth, guess, **kwargs):
+    """
+    This function runs search_turn with "pvs" in a narrow window around guess
+    (the last iteration's value), widening the window on the side the result
+    fell out of (twice as far each time) until the value is exact, as
+    pvs.aspiration_search does for a single position
+    """
+    window = ASPIRATION
+    alpha, beta = guess - window, guess + window
+
+    while True:
+        result = search_turn(alternatives, depth, "pvs", window=(alpha, beta), **kwargs)
+
+        if result[2] is None:
+            window *= 2
+            alpha = guess - window if window < 64 else -float("inf")
+        elif result[0] >= beta:
+            window *= 2
+            beta = guess + window if window < 64 else float("inf")
+        else:
+            return result
+
+
+def deepen_turn(
+    alternatives,
+    time_budget=None,
+    node_budget=None,
+    max_depth=None,
+    table=None,
+    ordering=None,
+    stop=None,
+    stats=None,
+    algo_choice="alpha-beta",
+    workers=None,
+):
+    """
+    This function runs search_turn at depth 1, 2, 3... on the iterative
+    deepening loop of iterative_deepening.deepen, and returns (value, power-up,
+    move, depth) of the last completed depth
+    With a single alternative (no power-up) this is iterative_deepening itself
+    With "pvs" every iteration after the first is an aspiration search around
+    the value of the one before
+    With workers every iteration is parallel_search.parallel_search_turn on a
+    pool of that many processes (their tables are their own, not table)
+    """
+    game = alternatives[0][1]
+
+    if len(alternatives) == 1 and workers is None:
+        value, move, depth = iterative_deepening(
+            game,
+            time_budget,
+            node_budget,
+            max_depth,
+            table,
+            ordering,
+            stop,
+            stats,
+            algo_choice,
+        )
+
+        return value, None, move, depth
+
+    if table is None:
+        table = TranspositionTable()
+    if ordering is None:
+        ordering = MoveOrderer(game.geometry.line_count)
+
+    free_lines = max(len(position.legal_lines()) for _, position, _ in alternatives)
+    max_depth = free_lines if max_depth is None else min(max_depth, free_lines)
+    geo = game.geometry
+
+    def step(depth, limits, best):
+        first = None if best is None else (best[1], geo.line_index[best[2]])
+        if workers is not None:
+            return parallel_search_turn(
+                alternatives,
+                depth,
+                algo_choice,
+                limits,
+                ordering,
+                first,
+                workers,
+                stats,
+            )
+        if best is None:
+            return search_turn(
+                alternatives, depth, algo_choice, table, ordering=ordering, stats=stats
+            )
+
+        kwargs = {
+            "table": table,
+            "limits": limits,
+            "ordering": ordering,
+            "first": first,
+            "stats": stats,
+        }
+        if algo_choice == "pvs":
+            return aspiration_turn(alternatives, depth, best[0], **kwargs)
+
+        return search_turn(alternatives, depth, **kwargs)
+
+    best, depth = deepen(step, max_depth, time_budget, node_budget, stop, stats)
+
+    return (*best, depth)
+
+
+def sample_swap(
+    game,
+    move,
+    depth,
+    threshold,
+    algo_choice="alpha-beta",
+    table=None,
+    ordering=None,
+    limits=None,
+    samples=SWAP_SAMPLES,
+):
+    """
+    This function weighs Swap Token as a chance node: it searches random
+    outcomes of it with the AI drawing move (see swap_outcome) one at a time,
+    and returns (mean value, outcomes searched), or None if there was no time
+    for even one
+    Like a turn searched to depth, an outcome is searched to depth - 1 after
+    the AI's line; the lines the swap forces on the player come on top
+    It stops as soon as the mean is clear of threshold (the value of the best
+    turn without Swap Token, searched to depth) by SWAP_CONFIDENCE
+    standard errors either way, so a clear-cut decision takes SWAP_MIN_SAMPLES
+    searches and only a close one takes all of samples
+    Outcomes that repeat are looked up instead of searched again, and all the
+    searches share the table and move ordering, so positions the outcomes have
+    in common below them are only searched once
+    """
+    cache = {}  # This stores outcome position -> value
+    values = []
+
+    for _ in range(samples):
+        outcome = swap_outcome(game, move)
+        key = (
+            outcome.drawn,
+            outcome.ai_lines,
+            outcome.claimed,
+            outcome.ai_boxes,
+            outcome.power_tokens[Player.PLAYER],
+        )
+
+        if key not in cache:
+            if outcome.is_terminal():
+                cache[key] = outcome.evaluate()
+            else:
+                try:
+                    cache[key] = search_position(
+                        outcome, depth - 1, algo_choice, table, limits, ordering
+                    )
+                except SearchTimeout:
+                    if limits.stop is not None and limits.stop.is_set():
+                        raise
+                    break  # Out of budget: decide on the outcomes searched so far
+
+        values.append(cache[key])
+
+        n = len(values)
+        if n >= SWAP_MIN_SAMPLES:
+            mean = sum(values) / n
+            sd = math.sqrt(sum((v - mean) ** 2 for v in values) / (n - 1))
+            margin = SWAP_CONFIDENCE * sd / math.sqrt(n)
+            if mean - margin > threshold or mean + margin <= threshold:
+                break
+
+    if not values:
+        return None
+
+    return sum(values) / len(values), len(values)
+
+
+def ai_turn(
+    game,
+    algo_choice,
+    ai_depth,
+    ai_budget,
+    ai_prob,
+    table,
+    stop=None,
+    stats=None,
+    engine=None,
+    workers=None,
+):
+    """
+    This function decides the AI's turn and returns (power-up, move), where a
+    power-up of None means no token is used
+    Playing without a power-up and each power-up are root alternatives of one
+    search, so the turn costs a single search instead of one per power-up
+    It runs on the AI worker thread, so it only searches copies of the game,
+    and it gives up (raising SearchTimeout) as soon as stop is set
+    With stats (see search_stats.SearchStats) the turn is reported once decided
+    "pvs" is alpha-beta as a principal variation search with aspiration
+    windows; "mcts" searches with engine (an mcts.MCTS kept for the whole game,
+    so its tree carries over between turns), plays no power-ups, and takes a
+    node budget as its number of playouts
+    Swap Token has a random outcome, so it is not a root alternative: once the
+    rest is decided, sample_swap weighs it over several outcomes, on a share of
+    the turn's budget, against the best turn without it at the same depth; if
+    it is used, the AI plays its best line on the board as it is
+    With workers the root moves are searched on a process pool of that many
+    workers (see parallel_search.parallel_search_turn); the Swap Token
+    outcomes are still searched here, one at a time
+    """
+    if stats is not None:
+        stats.reset()  # Drops whatever a cancelled search left behind
+
+    if algo_choice == "mcts":
+        move = engine.search(
+            game, ai_budget.get("time_budget"), ai_budget.get("node_budget"), stop
+        )
+        if stats is not None:
+            stats.finish(
+                algo=algo_choice,
+                size=game.size,
+                free_lines=len(game.free_lines),
+                move=move,
+                **engine.last_search,
+            )
+
+        return None, move
+
+    use_power = random.random() < ai_prob
+    alternatives = root_alternatives(game, use_power)
+    ordering = MoveOrderer(game.geometry.line_count)
+
+    def search(alternatives, depth, limits):
+        if workers is not None:
+            return parallel_search_turn(
+                alternatives,
+                depth,
+                algo_choice,
+                limits,
+                ordering,
+                workers=workers,
+                stats=stats,
+            )
+
+        return search_turn(
+            alternatives, depth, algo_choice, table, limits, ordering, stats=stats
+        )
+
+    if algo_choice in ("alpha-beta", "pvs"):
+        table.new_search()
+        value, action, move, depth = deepen_turn(
+            alternatives,
+            table=table,
+            ordering=ordering,
+            stop=stop,
+            stats=stats,
+            algo_choice=algo_choice,
+            workers=workers,
+            **ai_budget,
+        )
+    else:
+        depth = ai_depth
+        value, action, move = search(alternatives, ai_depth, SearchLimits(stop=stop))
+
+    swap = None
+    if can_swap(game, use_power):
+        limits = SearchLimits(
+            (ai_budget.get("time_budget") or 0) * SWAP_SHARE or None,
+            int((ai_budget.get("node_budget") or 0) * SWAP_SHARE) or None,
+            stop,
+        )
+        swap_depth = max(1, depth - 1) if algo_choice != "minimax" else depth
+        threshold = value  # The best turn without Swap Token, at swap_depth
+        # The line drawn with Swap Token: the best one without a power-up, as
+        # the swap's random lines only come after it
+        plain_move = move if action is None else None
+
+        try:
+            # Both mostly answered by the tables the deeper search just filled
+            if swap_depth != depth:
+                threshold, _, _ = search(alternatives, swap_depth, limits)
+            if plain_move is None:
+                _, _, plain_move = search(alternatives[:1], swap_depth, limits)
+            swap = sample_swap(
+                game,
+                plain_move,
+                swap_depth,
+                threshold,
+                algo_choice,
+                table,
+                ordering,
+                limits,
+            )
+        except SearchTimeout:
+            if stop is not None and stop.is_set():
+                raise
+
+        if swap is not None and swap[0] > threshold:
+            action, move = "Swap Token", plain_move
+
+    if stats is not None:
+        stats.finish(
+            algo=algo_choice,
+            size=game.size,
+            free_lines=len(game.free_lines),
+            alternatives=len(alternatives),
+            depth=depth,
+            value=value,
+            action=action,
+            move=move,
+            swap_samples=swap[1] if swap is not None else 0,
+            swap_value=swap[0] if swap is not None else None,
+        )
+
+    return action, move
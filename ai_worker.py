@@ -0,0 +1,145 @@
+import threading
+from constants import Player
+from iterative_deepening import SearchTimeout
+from move_ordering import MoveOrderer
+
+# How many of the player's likeliest moves are answered ahead of time
+PONDER_MOVES = 8
+
+
+def position_key(game):
+    """
+    This function returns everything the AI's decision depends on, so a reply
+    worked out while pondering is only reused for exactly the same position
+    """
+    return (
+        game.drawn,
+        game.ai_lines,
+        game.claimed,
+        game.ai_boxes,
+        game.current_player,
+        game.power_tokens[Player.PLAYER],
+        game.power_tokens[Player.AI],
+        game.last_move,
+        game.last_move_done_by,
+        game.power_used_this_turn,
+    )
+
+
+def likely_moves(game, count=PONDER_MOVES):
+    """
+    This function returns the lines the player is most likely to draw next:
+    box-completing lines first, then safe lines, then sacrifices
+    """
+    orderer = MoveOrderer(game.geometry.line_count)
+
+    return orderer.order(game, game.legal_lines(), 0)[:count]
+
+
+class AIWorker:
+    """
+    This class runs the AI's searches on a background thread, so the game loop
+    keeps drawing the board and handling events while the AI thinks
+    A search is cancelled by setting its stop event, which every search checks
+    (through SearchLimits) every few hundred nodes
+    While the player thinks, the worker ponders: it works out the AI's reply to
+    each of the player's likeliest moves, and keeps them in pondered
+    on_done, if given, is called on the worker thread whenever a search
+    started with start() ends, so the game loop can sleep until then
+    """
+
+    def __init__(self, on_done=None):
+        self.on_done = on_done
+        self.thread = None
+        self.stop = threading.Event()
+        self.result = None  # The decision of the last search, once it is done
+        self.error = None  # The exception the last search failed with, if any
+        self.pondered = {}  # This stores position_key -> decision
+
+    def start(self, decide, game):
+        """
+        This function starts decide(game, stop) on the worker thread; game must
+        be a copy the game loop does not touch while the search runs
+        """
+        self.cancel()
+        self.result = self.error = None
+
+        def run(stop):
+            try:
+                result = decide(game, stop)
+
+                # A search that ends early can still return; that move is not kept
+                if not stop.is_set():
+                    self.result = result
+            except Exception as error:
+                # A cancelled search ends with SearchTimeout; anything else is
+                # kept for decision() to raise on the game loop's thread
+                if not stop.is_set():
+                    self.error = error
+            finally:
+                if self.on_done is not None:
+                    self.on_done()
+
+        self._run(run)
+
+    def decision(self):
+        """
+        This function returns the decision of the search started last, once it
+        is done, or raises the exception the search failed with
+        """
+        if self.error is not None:
+            raise self.error
+
+        return self.result
+
+    def ponder(self, decide, game):
+        """
+        This function starts working out the AI's replies to the player's
+        likeliest moves from game (a copy, as for start)
+        """
+        self.cancel()
+        self.pondered = {}
+
+        def run(stop):
+            for line in likely_moves(game):
+                if stop.is_set():
+                    return
+
+                child = game.clone()
+                child.play(line)
+                if child.current_player != Player.AI or child.is_terminal():
+                    continue
+
+                try:
+                    decision = decide(child, stop)
+                except SearchTimeout:
+                    return
+
+                if not stop.is_set():
+                    self.pondered[position_key(child)] = decision
+
+        self._run(run)
+
+    def _run(self, target):
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=target, args=(self.stop,), daemon=True)
+        self.thread.start()
+
+    def busy(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def wait(self):
+        """
+        This function waits for the running search (if any) to end by itself
+        """
+        if self.thread is not None:
+            self.thread.join()
+
+    def cancel(self):
+        """
+        This function stops the running search (if any) and waits for it to end
+        """
+        if self.thread is not None:
+            self.stop.set()
+            self.thread.join()
+            self.thread = None
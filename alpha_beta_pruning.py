@@ -1,49 +1,186 @@
 from constants import Player
+from endgame import solve as solve_endgame
+from symmetry import from_canonical, to_canonical
+from tablebase import probe as probe_tablebase
+from transposition import EXACT, LOWER, UPPER
 
 
-def alpha_beta(game, depth, alpha, beta, maximizing):
+def alpha_beta(
+    game,
+    depth,
+    alpha,
+    beta,
+    maximizing,
+    in_place=False,
+    table=None,
+    limits=None,
+    ordering=None,
+    endgame=True,
+    stats=None,
+):
+    """
+    This function implements minimax with alpha-beta pruning
+    It works on the line indices of the bitboard and makes/unmakes moves on one
+    game state, so a search only allocates an undo record per level
+    Unless in_place is set, the caller's game is cloned once so it is never touched
+    With a transposition table, positions reached by another move order are
+    looked up instead of searched again; values are stored relative to the
+    current score so they stay valid whoever captured the boxes so far
+    With limits (see iterative_deepening.SearchLimits) every node is counted and
+    the search is abandoned by an exception once the budget is spent
+    With an ordering (see move_ordering.MoveOrderer) moves are sorted so the
+    likely best ones are searched first and cut the rest off sooner
+    Once no safe lines are left the chains-and-loops solver in endgame.py gives
+    the exact value and move, so the late game needs no tree search at all;
+    positions with few enough free lines are looked up in the tablebase of the
+    grid size (see tablebase.py), if one was built, before that
+    With stats (see search_stats.SearchStats) nodes, cutoffs and table lookups
+    are recorded
+    """
+    if limits is not None:
+        limits.tick()
+    if stats is not None:
+        stats.node(depth)
+
     if depth == 0 or game.is_terminal():
         return game.evaluate(), None
 
+    if endgame:
+        solved = probe_tablebase(game)
+        if solved is not None:
+            if stats is not None:
+                stats.tablebase += 1
+        else:
+            solved = solve_endgame(game)
+            if solved is not None and stats is not None:
+                stats.solved += 1
+
+        if solved is not None:
+            value, line = solved
+            if game.current_player != Player.AI:
+                value = -value
+
+            return game.evaluate() + value, game.geometry.line_moves[line]
+
+    if not in_place:
+        game = game.clone()
+
+    moves = game.legal_lines()
+    tt_move = None
+
+    if table is not None:
+        key, sym = table.key_of(game)
+        score = game.evaluate()
+        entry = table.probe(key)
+        if stats is not None:
+            stats.probe(entry is not None)
+
+        if entry is not None:
+            _, entry_depth, value, flag, tt_move, _ = entry
+            tt_move = from_canonical(game, sym, tt_move)
+
+            if entry_depth >= depth:
+                value += score
+
+                if flag == LOWER:
+                    alpha = max(alpha, value)
+                elif flag == UPPER:
+                    beta = min(beta, value)
+                if flag == EXACT or beta <= alpha:
+                    if stats is not None:
+                        stats.table_cuts += 1
+                    return value, game.geometry.line_moves[tt_move]
+
+        # The window actually searched decides which bound the result is
+        alpha_orig, beta_orig = alpha, beta
+
+    if ordering is not None:
+        moves = ordering.order(game, moves, depth, tt_move)
+    elif tt_move is not None:
+        # Whatever its depth, the stored best move is searched first
+        moves.remove(tt_move)
+        moves.insert(0, tt_move)
+
     best_move = None
 
     if maximizing:
         max_eval = float("-inf")
 
-        for move in game.get_possible_moves():
-            new_game = game.clone()
-            new_game.make_move(move)
+        for i, line in enumerate(moves):
+            undo = game.play(line)
             eval, _ = alpha_beta(
-                new_game, depth - 1, alpha, beta, new_game.current_player == Player.AI
+                game,
+                depth - 1,
+                alpha,
+                beta,
+                game.current_player == Player.AI,
+                True,
+                table,
+                limits,
+                ordering,
+                endgame,
+                stats,
             )
+            game.undo_move(undo)
 
             if eval > max_eval:
                 max_eval = eval
-                best_move = move
+                best_move = line
             alpha = max(alpha, eval)
 
             if beta <= alpha:
+                if ordering is not None:
+                    ordering.record_cutoff(line, depth)
+                if stats is not None:
+                    stats.cutoff(depth, i)
                 break
 
-        return max_eval, best_move
+        best_eval = max_eval
 
     else:
         min_eval = float("inf")
 
-        for move in game.get_possible_moves():
-            new_game = game.clone()
-            new_game.make_move(move)
+        for i, line in enumerate(moves):
+            undo = game.play(line)
             eval, _ = alpha_beta(
-                new_game, depth - 1, alpha, beta, new_game.current_player == Player.AI
+                game,
+                depth - 1,
+                alpha,
+                beta,
+                game.current_player == Player.AI,
+                True,
+                table,
+                limits,
+                ordering,
+                endgame,
+                stats,
             )
+            game.undo_move(undo)
 
             if eval < min_eval:
                 min_eval = eval
-                best_move = move
+                best_move = line
 
             beta = min(beta, eval)
 
             if beta <= alpha:
+                if ordering is not None:
+                    ordering.record_cutoff(line, depth)
+                if stats is not None:
+                    stats.cutoff(depth, i)
                 break
 
-        return min_eval, best_move
+        best_eval = min_eval
+
+    if table is not None:
+        if best_eval <= alpha_orig:
+            flag = UPPER
+        elif best_eval >= beta_orig:
+            flag = LOWER
+        else:
+            flag = EXACT
+        table.store(
+            key, depth, best_eval - score, flag, to_canonical(game, sym, best_move)
+        )
+
+    return best_eval, game.geometry.line_moves[best_move]
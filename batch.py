@@ -0,0 +1,227 @@
+from functools import lru_cache
+from constants import Player
+from logic import DotsAndBoxesGame, board_geometry, iter_bits
+
+try:
+    import numpy as np
+except ImportError:  # Only batched evaluation needs numpy, the game itself does not
+    np = None
+
+PLAYER, AI = Player.PLAYER.value, Player.AI.value  # Owner codes; 0 means nobody
+
+
+@lru_cache(maxsize=None)
+def batch_geometry(size):
+    """
+    This function returns the index arrays the batch kernels gather with:
+    box_lines (boxes x 4, the sides of every box) and line_boxes (lines x 2,
+    the boxes next to every line, -1 where a border line has only one)
+    Gathering through them is much faster than an integer matrix product with
+    the line/box incidence matrix, which numpy cannot hand to BLAS
+    """
+    geo = board_geometry(size)
+    box_lines = np.zeros((geo.box_count, 4), np.intp)
+    line_boxes = np.full((geo.line_count, 2), -1, np.intp)
+
+    for b, mask in enumerate(geo.box_line_masks):
+        box_lines[b] = list(iter_bits(mask))
+    for line, boxes in enumerate(geo.line_boxes):
+        line_boxes[line, : len(boxes)] = boxes
+
+    return box_lines, line_boxes
+
+
+class GameBatch:
+    """
+    This class holds N games of one grid size as arrays, so a whole batch of
+    positions is scored or played out per numpy call instead of one at a time
+    lines is N x lines (owner code of every line, 0 if it is not drawn), boxes
+    is N x boxes (owner code of every box) and current is the side to move
+    The batch plays plain dots and boxes: power tokens are not part of it
+    """
+
+    def __init__(self, size, count=0):
+        if np is None:
+            raise ImportError("batch evaluation needs numpy (pip install numpy)")
+
+        self.size = size
+        self.geometry = board_geometry(size)
+        self.box_lines, self.line_boxes = batch_geometry(size)
+        self.lines = np.zeros((count, self.geometry.line_count), np.uint8)
+        self.boxes = np.zeros((count, self.geometry.box_count), np.uint8)
+        self.current = np.full(count, PLAYER, np.uint8)
+
+    @classmethod
+    def from_games(cls, games):
+        """
+        This function packs DotsAndBoxesGame states (all of one size) into a batch
+        """
+        batch = cls(games[0].size, len(games))
+
+        for i, game in enumerate(games):
+            for line in iter_bits(game.drawn):
+                batch.lines[i, line] = AI if game.ai_lines >> line & 1 else PLAYER
+            for box in iter_bits(game.claimed):
+                batch.boxes[i, box] = AI if game.ai_boxes >> box & 1 else PLAYER
+            batch.current[i] = game.current_player.value
+
+        return batch
+
+    def game(self, i):
+        """
+        This function unpacks game i of the batch into a DotsAndBoxesGame
+        """
+        game = DotsAndBoxesGame(self.size)
+        game.drawn = sum(1 << int(line) for line in np.flatnonzero(self.lines[i]))
+        game.ai_lines = sum(
+            1 << int(line) for line in np.flatnonzero(self.lines[i] == AI)
+        )
+        game.claimed = sum(1 << int(box) for box in np.flatnonzero(self.boxes[i]))
+        game.ai_boxes = sum(
+            1 << int(box) for box in np.flatnonzero(self.boxes[i] == AI)
+        )
+        game.current_player = Player(int(self.current[i]))
+        game.rebuild_indexes()
+
+        return game
+
+    def __len__(self):
+        return len(self.current)
+
+    def side_counts(self):
+        """
+        This function returns N x boxes: how many sides of every box are drawn
+        """
+        return (self.lines != 0)[:, self.box_lines].sum(axis=2, dtype=np.uint8)
+
+    def legal_mask(self):
+        return self.lines == 0
+
+    def is_terminal(self):
+        return ~self.legal_mask().any(axis=1)
+
+    def _next_to(self, box_mask):
+        """
+        This function returns N x lines, True for the lines next to a box that
+        is set in box_mask (N x boxes)
+        """
+        # The extra False column is what the -1 of a border line picks up
+        padded = np.pad(box_mask, ((0, 0), (0, 1)))
+
+        return padded[:, self.line_boxes].any(axis=2)
+
+    def completed_mask(self, counts=None):
+        """
+        This function returns N x boxes, True where all four sides are drawn
+        """
+        counts = self.side_counts() if counts is None else counts
+
+        return counts == 4
+
+    def completing_mask(self, counts=None):
+        """
+        This function returns N x lines, True for the free lines that would
+        complete a box (a box with three sides drawn)
+        """
+        counts = self.side_counts() if counts is None else counts
+
+        return self.legal_mask() & self._next_to(counts == 3)
+
+    def sacrifice_mask(self, counts=None):
+        """
+        This function returns N x lines, True for the free lines that complete
+        nothing but give a box its third side
+        """
+        counts = self.side_counts() if counts is None else counts
+        gives = self.legal_mask() & self._next_to(counts == 2)
+
+        return gives & ~self.completing_mask(counts)
+
+    def evaluate(self):
+        """
+        This function returns the AI's boxes minus the player's for every game,
+        as DotsAndBoxesGame.evaluate does
+        """
+        ai = (self.boxes == AI).sum(axis=1, dtype=np.int32)
+
+        return ai - (self.boxes == PLAYER).sum(axis=1, dtype=np.int32)
+
+    def play(self, lines):
+        """
+        This function draws lines[i] in game i (games with -1 are left as they
+        are), claims the boxes it completes and passes the turn where it
+        completed none
+        """
+        rows = np.flatnonzero(lines >= 0)
+        drawn = lines[rows]
+        mover = self.current[rows]
+        self.lines[rows, drawn] = mover
+
+        boxes = self.line_boxes[drawn]  # (rows, 2), -1 padded
+        valid = boxes >= 0
+        safe = np.where(valid, boxes, 0)
+        sides = self.lines[rows[:, None, None], self.box_lines[safe]] != 0
+        closed = valid & sides.all(axis=2) & (self.boxes[rows[:, None], safe] == 0)
+
+        for k in range(2):
+            hit = closed[:, k]
+            self.boxes[rows[hit], safe[hit, k]] = mover[hit]
+
+        passed = ~closed.any(axis=1)
+        self.current[rows[passed]] = AI + PLAYER - mover[passed]
+
+    def random_moves(self, rng):
+        """
+        This function picks a uniformly random free line for every game (-1 for
+        finished games), with rng a numpy Generator
+        """
+        scores = rng.random(self.lines.shape)
+        scores[~self.legal_mask()] = -1.0
+        moves = scores.argmax(axis=1)
+        moves[self.is_terminal()] = -1
+
+        return moves
+
+    def playout(self, rng=None, policy=None):
+        """
+        This function plays every game of the batch to the end in place and
+        returns the final evaluate() of each
+        policy(batch, rng) picks the moves; without one every move is uniformly
+        random
+        """
+        rng = np.random.default_rng() if rng is None else rng
+
+        if policy is not None:
+            while not self.is_terminal().all():
+                self.play(policy(self, rng))
+
+            return self.evaluate()
+
+        # Uniformly random play draws the free lines in a random order, so the
+        # whole playout is one shuffle and then one column of it per ply
+        legal = self.legal_mask()
+        keys = rng.random(self.lines.shape)
+        keys[~legal] = 2.0  # Drawn lines sort behind the free ones
+        order = keys.argsort(axis=1)
+        free = legal.sum(axis=1)
+
+        for ply in range(int(free.max(initial=0))):
+            self.play(np.where(ply < free, order[:, ply], -1))
+
+        return self.evaluate()
+
+
+def greedy_moves(batch, rng):
+    """
+    This function is a playout policy that takes a box when it can, otherwise
+    draws a line that gives nothing away, and only sacrifices when it must
+    """
+    counts = batch.side_counts()
+    scores = rng.random(batch.lines.shape)
+    scores += batch.completing_mask(counts) * 2.0
+    scores -= batch.sacrifice_mask(counts) * 2.0
+    scores[~batch.legal_mask()] = -10.0
+    moves = scores.argmax(axis=1)
+    moves[batch.is_terminal()] = -1
+
+    return moves
@@ -0,0 +1,292 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from alpha_beta_pruning import alpha_beta
+from constants import Player
+from iterative_deepening import SearchLimits, SearchTimeout
+from logic import DotsAndBoxesGame
+from minimax import minimax
+from move_ordering import MoveOrderer
+from pvs import pvs
+from transposition import TranspositionTable
+
+SIZES = (3, 4, 5, 6, 8, 10, 12, 15, 20)
+DEPTHS = (1, 2, 3, 4)
+POSITIONS = 3  # Seeded positions per grid size
+FILL = 0.3  # Share of the lines drawn in a corpus position
+NODE_CAP = 50000  # Searches that need more nodes are cut off (and marked capped)
+OPS_REPEAT = 2000  # Repetitions of each game-logic operation
+ROUNDS = 3  # Every timing is the best of this many runs, to keep noise out
+BASELINE = "benchmark_baseline.json"  # The stored run --baseline compares to
+# Allocation growth below this many blocks / bytes per search is noise (caches
+# warmed by an earlier search, ...), however many it is per node
+ALLOC_NOISE = {"blocks_per_node": 16, "bytes_per_node": 1024}
+
+
+def corpus(size, count=POSITIONS, seed=0, fill=FILL):
+    """
+    This function returns the fixed benchmark positions for a grid size
+    Each one is a seeded game with fill of its lines drawn (safe lines first,
+    so the boards look like real mid-games) and the AI to move
+    """
+    positions = []
+    rng = random.Random(seed * 1000 + size)
+
+    for _ in range(count):
+        game = DotsAndBoxesGame(size)
+        for _ in range(int(fill * game.geometry.line_count)):
+            lines = game.legal_lines()
+            safe = [line for line in lines if not game.gives_box(line)]
+            game.play(rng.choice(safe or lines))
+
+        game.current_player = Player.AI
+        positions.append(game)
+
+    return positions
+
+
+def _search(algo, game, depth, node_cap, trace=False):
+    """
+    This function runs one search and returns (nodes, capped, seconds,
+    memory), where capped means it was cut off at node_cap
+    The table and move orderer are set up outside the measurement, as the game
+    loop keeps them for a whole game; memory (only with trace) is what the
+    search itself allocates on top of that: its peak bytes, and the blocks and
+    bytes still allocated when it returns (table entries, kept move lists...)
+    """
+    limits = SearchLimits(node_budget=node_cap)
+    table = TranspositionTable()
+    ordering = MoveOrderer(game.geometry.line_count)
+    capped = False
+    memory = None
+
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        if algo == "minimax":
+            minimax(game, depth, True, limits=limits)
+        elif algo == "pvs":
+            pvs(game, depth, table=table, limits=limits, ordering=ordering)
+        else:
+            alpha_beta(
+                game,
+                depth,
+                -float("inf"),
+                float("inf"),
+                True,
+                table=table,
+                limits=limits,
+                ordering=ordering,
+            )
+    except SearchTimeout:
+        capped = True
+    finally:
+        elapsed = time.perf_counter() - start
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1]
+            kept = tracemalloc.take_snapshot().statistics("filename")
+            tracemalloc.stop()
+            memory = {
+                "peak": peak,
+                "blocks": sum(stat.count for stat in kept),
+                "bytes": sum(stat.size for stat in kept),
+            }
+
+    return min(limits.nodes, node_cap), capped, elapsed, memory
+
+
+def bench_search(algo, game, depth, node_cap=NODE_CAP, memory=True, rounds=ROUNDS):
+    """
+    This function returns the nodes, nodes/second and time-to-move of one
+    search (the fastest of rounds runs); with memory it runs the search once
+    more under tracemalloc (which slows it down) for its peak memory and the
+    blocks and bytes per node it leaves allocated
+    A search cut off at node_cap is marked capped and has no time-to-move
+    """
+    runs = [_search(algo, game, depth, node_cap) for _ in range(rounds)]
+    nodes, capped, elapsed, _ = min(runs, key=lambda run: run[2])
+
+    result = {
+        "nodes": nodes,
+        "capped": capped,
+        "nodes_per_sec": round(nodes / elapsed),
+        "time_to_move": None if capped else round(elapsed, 6),
+    }
+
+    if memory:
+        _, _, _, allocated = _search(algo, game, depth, node_cap, trace=True)
+        result["peak_bytes"] = allocated["peak"]
+        result["blocks_per_node"] = round(allocated["blocks"] / max(nodes, 1), 3)
+        result["bytes_per_node"] = round(allocated["bytes"] / max(nodes, 1), 2)
+
+    return result
+
+
+def _time_op(op, repeat):
+    best = float("inf")
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            op()
+        best = min(best, time.perf_counter() - start)
+
+    return round(best / repeat * 1e9)
+
+
+def bench_ops(game, repeat=OPS_REPEAT):
+    """
+    This function times the game-logic hot paths on a position and returns
+    nanoseconds per call (make_move includes taking the move back again)
+    """
+    move = game.get_possible_moves()[0]
+
+    def make_move():
+        game.undo_move(game.make_move(move))
+
+    return {
+        "clone_ns": _time_op(game.clone, repeat),
+        "make_move_ns": _time_op(make_move, repeat),
+        "get_possible_moves_ns": _time_op(game.get_possible_moves, repeat),
+    }
+
+
+def run(sizes=SIZES, depths=DEPTHS, algos=("minimax", "alpha-beta", "pvs"), **kw):
+    """
+    This function runs the whole suite and returns the results as a dict
+    Every search result is keyed by algo/size/depth/position, so two runs
+    (e.g. against a stored baseline) can be compared entry by entry
+    """
+    node_cap = kw.get("node_cap", NODE_CAP)
+    memory = kw.get("memory", True)
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "node_cap": node_cap,
+            "fill": kw.get("fill", FILL),
+        },
+        "search": {},
+        "ops": {},
+    }
+
+    for size in sizes:
+        positions = corpus(
+            size, kw.get("positions", POSITIONS), fill=kw.get("fill", FILL)
+        )
+        for i, game in enumerate(positions):
+            results["ops"][f"{size}/{i}"] = bench_ops(game)
+
+            for algo in algos:
+                for depth in depths:
+                    key = f"{algo}/{size}/{depth}/{i}"
+                    results["search"][key] = bench_search(
+                        algo, game, depth, node_cap, memory
+                    )
+                    print(key, results["search"][key], file=sys.stderr)
+
+    return results
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    This function compares a run against a baseline run and returns a list of
+    (key, metric, baseline value, new value) for every regression: a speed,
+    time-to-move, allocation per node or node count more than tolerance worse
+    (the corpus is fixed, so more nodes means the search itself got worse;
+    fewer nodes is an improvement and not reported)
+    """
+    regressions = []
+
+    for key, new in results["search"].items():
+        old = baseline.get("search", {}).get(key)
+        if old is None:
+            continue
+
+        if new["nodes_per_sec"] < old["nodes_per_sec"] * (1 - tolerance):
+            regressions.append(
+                (key, "nodes_per_sec", old["nodes_per_sec"], new["nodes_per_sec"])
+            )
+        if new["time_to_move"] is not None and old["time_to_move"] is not None:
+            if new["time_to_move"] > old["time_to_move"] * (1 + tolerance):
+                regressions.append(
+                    (key, "time_to_move", old["time_to_move"], new["time_to_move"])
+                )
+        for metric, noise in ALLOC_NOISE.items():
+            if metric in new and metric in old:
+                limit = old[metric] * (1 + tolerance) + noise / max(new["nodes"], 1)
+                if new[metric] > limit:
+                    regressions.append((key, metric, old[metric], new[metric]))
+        if new["nodes"] > old["nodes"] * (1 + tolerance) and not old["capped"]:
+            regressions.append((key, "nodes", old["nodes"], new["nodes"]))
+
+    for key, new in results["ops"].items():
+        old = baseline.get("ops", {}).get(key, {})
+        for metric, value in new.items():
+            if metric in old and value > old[metric] * (1 + tolerance):
+                regressions.append((key, metric, old[metric], value))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the search and game-logic hot paths"
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--depths", type=int, nargs="+", default=DEPTHS)
+    parser.add_argument(
+        "--algos",
+        nargs="+",
+        default=["minimax", "alpha-beta", "pvs"],
+        metavar="ALGO",
+    )
+    parser.add_argument("--positions", type=int, default=POSITIONS)
+    parser.add_argument("--node-cap", type=int, default=NODE_CAP)
+    parser.add_argument(
+        "--fill", type=float, default=FILL, help="share of lines drawn in a position"
+    )
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc")
+    parser.add_argument("--out", default="-", help="results JSON (- for stdout)")
+    parser.add_argument(
+        "--baseline",
+        nargs="?",
+        const=BASELINE,
+        help=f"results JSON of an earlier run (without a file: {BASELINE})",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    results = run(
+        args.sizes,
+        args.depths,
+        args.algos,
+        positions=args.positions,
+        node_cap=args.node_cap,
+        fill=args.fill,
+        memory=not args.no_memory,
+    )
+
+    if args.out == "-":
+        json.dump(results, sys.stdout, indent=1)
+        print()
+    else:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+        for key, metric, old, new in regressions:
+            print(f"REGRESSION {key} {metric}: {old} -> {new}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
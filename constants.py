@@ -17,6 +17,7 @@ class Colors:
     BUTTON_HOVER = (150, 150, 255)
     PLAYER_LINE_COLOR = (0, 0, 0)
     AI_LINE_COLOR = (50, 50, 200)
+    HOVER_LINE_COLOR = (170, 170, 170)
     BONUS_COLOR = (255, 215, 0)
 
 
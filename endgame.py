@@ -0,0 +1,203 @@
+from functools import lru_cache
+from logic import iter_bits
+
+# Above this many sub-positions the chain/loop recursion is left to the search
+MAX_STATES = 1 << 16
+
+
+def analyse(game):
+    """
+    This function splits a loony endgame into its chains and loops
+    It returns None unless every free line is unsafe (it gives a box its third
+    side or completes one) and the unclaimed boxes form simple chains and loops
+    Otherwise it returns a list of components as (coins, open_ends, loop): the
+    boxes in path order, how many of them can be captured right now (0, 1 or 2)
+    and whether the component is a loop
+    """
+    geo = game.geometry
+    counts = game.side_counts
+
+    # Any safe line left (one that gives no box its third side) ends it early
+    for line in game.free_lines:
+        if all(counts[b] < 2 or game.claimed >> b & 1 for b in geo.line_boxes[line]):
+            return None
+
+    sides = {}
+    for b in iter_bits(~game.claimed & ((1 << geo.box_count) - 1)):
+        # A box with three or four free lines is a junction, not part of a chain
+        if counts[b] < 2:
+            return None
+
+        sides[b] = counts[b]
+
+    if not sides:
+        return None
+
+    # Strings and coins: every free line joins two boxes, or a box and the ground
+    neighbours = {b: [] for b in sides}
+    for line in game.free_lines:
+        coins = [b for b in geo.line_boxes[line] if b in sides]
+        if len(coins) == 2:
+            neighbours[coins[0]].append(coins[1])
+            neighbours[coins[1]].append(coins[0])
+
+    components = []
+    seen = set()
+
+    for start in sides:
+        if start in seen:
+            continue
+
+        # Walk to one end of the path (a loop has no end, any box will do)
+        end, prev = start, None
+        while True:
+            step = [n for n in neighbours[end] if n != prev]
+            if not step or step[0] == start:
+                break
+            end, prev = step[0], end
+
+        coins = []
+        coin = end
+        while coin is not None:
+            seen.add(coin)
+            coins.append(coin)
+            coin = next((n for n in neighbours[coin] if n not in seen), None)
+
+        loop = all(len(neighbours[c]) == 2 for c in coins)
+        open_ends = sum(sides[c] == 3 for c in coins)
+        components.append((coins, open_ends, loop))
+
+    return components
+
+
+def _opponent_value(loop, n, rest):
+    """
+    This function returns what the opponent nets when a closed chain or loop of
+    n boxes is opened and rest is the value of opening what remains afterwards
+    The opponent takes everything, or all but two (all but four for a loop)
+    and hands control back
+    """
+    if loop:
+        return max(n + rest, n - 8 - rest)
+    if n <= 2:
+        # Short chains are handed out so that they cannot be declined
+        return n + rest
+
+    return max(n + rest, n - 4 - rest)
+
+
+@lru_cache(maxsize=1 << 16)
+def controlled_value(closed):
+    """
+    This function returns the net score, from here on, of the player who has to
+    open one of the closed chains/loops in closed (a sorted tuple of
+    (loop, length) pairs) when both sides play perfectly
+    """
+    best = 0 if not closed else None
+
+    for i, (loop, n) in enumerate(closed):
+        if i and closed[i - 1] == (loop, n):
+            continue
+
+        value = -_opponent_value(
+            loop, n, controlled_value(closed[:i] + closed[i + 1 :])
+        )
+        if best is None or value > best:
+            best = value
+
+    return best
+
+
+def _free_lines(game, box):
+    return list(iter_bits(game.geometry.box_line_masks[box] & ~game.drawn))
+
+
+def _opening_line(game, coins, loop):
+    """
+    This function picks the line that opens a closed chain or loop
+    Two-chains are opened in the middle so the opponent cannot decline them,
+    longer chains at an end
+    """
+    line_boxes = game.geometry.line_boxes
+
+    if len(coins) == 2 and not loop:
+        return next(l for l in _free_lines(game, coins[0]) if coins[1] in line_boxes[l])
+
+    return next(
+        l
+        for l in _free_lines(game, coins[0])
+        if loop or not set(line_boxes[l]) & set(coins[1:])
+    )
+
+
+def solve(game):
+    """
+    This function returns (value, line) for a loony endgame, or None if the
+    position is not one: value is the net number of boxes the player to move
+    gets from here on with perfect play, and line is an optimal move
+    """
+    components = analyse(game)
+    if components is None:
+        return None
+
+    closed = tuple(
+        sorted((loop, len(coins)) for coins, ends, loop in components if not ends)
+    )
+    states = 1
+    for part in set(closed):
+        states *= closed.count(part) + 1
+    if states > MAX_STATES:
+        return None
+
+    opened = [comp for comp in components if comp[1]]
+
+    if not opened:
+        # Open the chain or loop that leaves the opponent the least
+        best = None
+        for coins, _, loop in components:
+            i = closed.index((loop, len(coins)))
+            rest = controlled_value(closed[:i] + closed[i + 1 :])
+            value = -_opponent_value(loop, len(coins), rest)
+            if best is None or value > best[0]:
+                best = (value, _opening_line(game, coins, loop))
+
+        return best
+
+    # Something was opened: take it all, or decline the last two (or four)
+    # boxes of one component so the opponent has to open the next one
+    rest = controlled_value(closed)
+    total = sum(len(coins) for coins, _, _ in opened)
+    value = total + rest
+    decline = None
+
+    for comp in opened:
+        give = 2 if comp[1] == 1 else 4
+        if len(comp[0]) >= give and total - 2 * give - rest > value:
+            decline = comp
+            value = total - 2 * give - rest
+
+    others = [comp for comp in opened if comp is not decline]
+    if decline is not None and not others:
+        coins, ends, _ = decline
+
+        if ends == 1 and len(coins) == 2:
+            # Leave a domino: draw the far line of the box with two sides
+            near, far = coins if len(_free_lines(game, coins[0])) == 1 else coins[::-1]
+            return value, next(
+                l
+                for l in _free_lines(game, far)
+                if near not in game.geometry.line_boxes[l]
+            )
+        if ends == 2 and len(coins) == 4:
+            # Leave two dominoes: cut the line between the middle two boxes
+            return value, next(
+                l
+                for l in _free_lines(game, coins[1])
+                if coins[2] in game.geometry.line_boxes[l]
+            )
+
+    # Otherwise capture, from the components not being declined first
+    coins = (others[0] if others else decline)[0]
+    box = next(c for c in coins if len(_free_lines(game, c)) == 1)
+
+    return value, _free_lines(game, box)[0]
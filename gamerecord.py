@@ -0,0 +1,225 @@
+import time
+from constants import Player
+from logic import DotsAndBoxesGame
+from powerups import POWER_UPS, PowerUps
+
+# An archive is MAGIC followed by records, each a varint length and its body,
+# so a reader can stream through it (and skip records) without loading it all
+# A body is a header (grid size, first player, start time in unix seconds and
+# both final scores, as varints) and then the events of the game, each a varint
+# (value << 2 | kind) followed by its think time in milliseconds:
+#   LINE       value is the line index drawn
+#   LINE_SWAP  the same, then a varint: the random line Swap Token drew after it
+#   POWER      value is the index of the power-up used in POWER_UPS
+MAGIC = b"DBGR\x01"
+LINE, LINE_SWAP, POWER = 0, 1, 2
+
+
+def write_varint(out, n):
+    """
+    This function appends n (>= 0) to the bytearray out as an unsigned LEB128
+    varint: 7 bits per byte, low bits first, the top bit set on all but the last
+    """
+    while n > 0x7F:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def read_varint(data, pos):
+    """
+    This function decodes the varint at data[pos] and returns (value, next pos)
+    """
+    n = shift = 0
+
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _read_varint_file(f):
+    """
+    This function reads a varint from a file, or returns None at its end
+    """
+    n = shift = 0
+
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        n |= (byte[0] & 0x7F) << shift
+        if byte[0] < 0x80:
+            return n
+        shift += 7
+
+
+class GameRecorder:
+    """
+    This class records one game as it is played: the game loop reports every
+    power-up used and every line drawn through PowerUps, and finish() returns
+    the encoded record
+    The think time of an event is the time since the previous one
+    """
+
+    def __init__(self, game):
+        self.size = game.size
+        self.first = game.current_player
+        self.started = int(time.time())
+        self.events = bytearray()
+        self.mark = time.perf_counter()
+
+    def _think(self):
+        now = time.perf_counter()
+        write_varint(self.events, round((now - self.mark) * 1000))
+        self.mark = now
+
+    def use(self, action):
+        write_varint(self.events, POWER_UPS.index(action) << 2 | POWER)
+        self._think()
+
+    def play(self, game, move, swap=None):
+        """
+        This function records move (drawn on game) and swap, the random line a
+        Swap Token drew after it, if any (what PowerUps.play returned)
+        """
+        line = game.geometry.line_index[move]
+
+        if swap is None:
+            write_varint(self.events, line << 2 | LINE)
+        else:
+            write_varint(self.events, line << 2 | LINE_SWAP)
+            write_varint(self.events, game.geometry.line_index[swap])
+        self._think()
+
+    def finish(self, game):
+        """
+        This function returns the whole record (length prefix included) of the
+        game, once it is over
+        """
+        body = bytearray()
+        for n in (self.size, self.first.value, self.started):
+            write_varint(body, n)
+        write_varint(body, game.player_score)
+        write_varint(body, game.ai_score)
+        body += self.events
+
+        record = bytearray()
+        write_varint(record, len(body))
+
+        return bytes(record + body)
+
+
+class _Scripted:
+    """
+    This class stands in for the random module of PowerUps during a replay,
+    so Swap Token draws the line the record says it drew
+    """
+
+    def __init__(self, move):
+        self.move = move
+
+    def choice(self, moves):
+        return self.move
+
+
+class GameRecord:
+    """
+    This class is one recorded game: the header fields are decoded right away
+    and the events only when they are iterated
+    """
+
+    def __init__(self, body):
+        self.body = body
+        pos = 0
+        fields = []
+        for _ in range(5):
+            n, pos = read_varint(body, pos)
+            fields.append(n)
+
+        self.size, first, self.started, self.player_score, self.ai_score = fields
+        self.first = Player(first)
+        self.start = pos  # Where the events begin
+
+    def events(self):
+        """
+        This function yields every event as (power-up, line, swap line, think
+        time in seconds): power-up is None for a line drawn, and line and swap
+        are None where they do not apply
+        """
+        body = self.body
+        pos = self.start
+
+        while pos < len(body):
+            tag, pos = read_varint(body, pos)
+            kind, value = tag & 3, tag >> 2
+            action = line = swap = None
+
+            if kind == POWER:
+                action = POWER_UPS[value]
+            else:
+                line = value
+                if kind == LINE_SWAP:
+                    swap, pos = read_varint(body, pos)
+
+            think, pos = read_varint(body, pos)
+            yield action, line, swap, think / 1000
+
+    def replay(self):
+        """
+        This function plays the game back on a new DotsAndBoxesGame, through
+        the same PowerUps rules as the game loop, and yields (game, event) after
+        every event; the game is updated in place
+        """
+        game = DotsAndBoxesGame(self.size)
+        game.current_player = self.first
+        rules = PowerUps()
+        moves = game.geometry.line_moves
+
+        for event in self.events():
+            action, line, swap, _ = event
+
+            if action is not None:
+                if not rules.use(game, game.current_player, action):
+                    raise ValueError(f"{action} cannot be used here")
+            else:
+                rules.rng = _Scripted(None if swap is None else moves[swap])
+                rules.play(game, moves[line])
+
+            yield game, event
+
+
+def append_record(path, record):
+    """
+    This function appends an encoded record to an archive, starting the
+    archive if the file does not exist yet
+    """
+    with open(path, "ab") as f:
+        if f.tell() == 0:
+            f.write(MAGIC)
+        f.write(record)
+
+
+def read_records(path):
+    """
+    This function yields the records of an archive one at a time, reading
+    only as far as it has got (a record cut short at the end, e.g. by a crash
+    while it was written, is left out)
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a game record archive")
+
+        while True:
+            length = _read_varint_file(f)
+            if length is None:
+                return
+
+            body = f.read(length)
+            if len(body) < length:
+                return
+
+            yield GameRecord(body)
@@ -0,0 +1,155 @@
+import time
+from alpha_beta_pruning import alpha_beta
+from constants import Player
+from endgame import solve as solve_endgame
+from move_ordering import MoveOrderer
+from pvs import aspiration_search
+from transposition import TranspositionTable
+
+
+class SearchTimeout(Exception):
+    """
+    This exception is raised inside a search once its budget has run out
+    """
+
+
+class SearchLimits:
+    """
+    This class counts the nodes of a search and stops it (by raising
+    SearchTimeout) once the wall-clock or node budget is used up, or once the
+    stop event (a threading.Event) is set by whoever started the search
+    The clock and the event are only checked every few hundred nodes to keep
+    the check cheap
+    """
+
+    CHECK_EVERY = 256
+
+    def __init__(self, time_budget=None, node_budget=None, stop=None):
+        self.start = time.perf_counter()
+        self.deadline = None if time_budget is None else self.start + time_budget
+        self.node_budget = node_budget
+        self.stop = stop
+        self.nodes = 0
+
+    def tick(self):
+        self.nodes += 1
+
+        if self.node_budget is not None and self.nodes > self.node_budget:
+            raise SearchTimeout()
+        if self.nodes % self.CHECK_EVERY == 0:
+            if self.deadline is not None and time.perf_counter() > self.deadline:
+                raise SearchTimeout()
+            if self.stop is not None and self.stop.is_set():
+                raise SearchTimeout()
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+
+def deepen(step, max_depth, time_budget=None, node_budget=None, stop=None, stats=None):
+    """
+    This function is the iterative deepening loop itself: it calls
+    step(depth, limits, best) at depth 1, 2, 3... where best is what the last
+    completed depth returned, until the time or node budget runs out or
+    max_depth is reached, and returns (best, depth) of the last completed depth
+    Depth 1 runs without limits (and with best None), so there is always a result
+    Setting stop (a threading.Event) ends the search early, like a timeout
+    With stats (see search_stats.SearchStats) every completed iteration is
+    recorded with its nodes and wall time
+    """
+    limits = SearchLimits(time_budget, node_budget, stop)
+    best = step(1, None, None)
+    depth = 1
+    if stats is not None:
+        stats.iteration(depth)
+
+    while depth < max_depth:
+        # A deeper iteration takes several times as long as the last one,
+        # so there is no point starting it with less than half the budget left
+        if time_budget is not None and limits.elapsed() > time_budget / 2:
+            break
+
+        try:
+            result = step(depth + 1, limits, best)
+        except SearchTimeout:
+            break
+
+        depth += 1
+        best = result
+        if stats is not None:
+            stats.iteration(depth)
+
+    return best, depth
+
+
+def iterative_deepening(
+    game,
+    time_budget=None,
+    node_budget=None,
+    max_depth=None,
+    table=None,
+    ordering=None,
+    stop=None,
+    stats=None,
+    algo_choice="alpha-beta",
+):
+    """
+    This function runs alpha-beta at depth 1, 2, 3... (see deepen) until the
+    time or node budget runs out, and returns (value, move, depth) of the last
+    completed depth
+    Every iteration leaves its best moves in the transposition table and its
+    killer/history scores in the move orderer, which the next (deeper)
+    iteration then uses to try the best moves first
+    With "pvs" the iterations are principal variation searches, every one
+    after the first in an aspiration window around the value of the one before
+    Loony endgames are solved exactly up front, without any search (this is
+    reported as depth 1, so follow-up searches at the returned depth stay cheap)
+    """
+    solved = solve_endgame(game)
+    if solved is not None:
+        value, line = solved
+        if game.current_player != Player.AI:
+            value = -value
+
+        return game.evaluate() + value, game.geometry.line_moves[line], 1
+
+    if table is None:
+        table = TranspositionTable()
+    if ordering is None:
+        ordering = MoveOrderer(game.geometry.line_count)
+
+    maximizing = game.current_player == Player.AI
+    free_lines = len(game.legal_lines())
+    max_depth = free_lines if max_depth is None else min(max_depth, free_lines)
+
+    def step(depth, limits, best):
+        if algo_choice == "pvs" and best is not None:
+            value, pv = aspiration_search(
+                game,
+                depth,
+                best[0],
+                table=table,
+                limits=limits,
+                ordering=ordering,
+                stats=stats,
+            )
+
+            return value, pv[0]
+
+        return alpha_beta(
+            game,
+            depth,
+            -float("inf"),
+            float("inf"),
+            maximizing,
+            table=table,
+            limits=limits,
+            ordering=ordering,
+            stats=stats,
+        )
+
+    (value, move), depth = deepen(
+        step, max_depth, time_budget, node_budget, stop, stats
+    )
+
+    return value, move, depth
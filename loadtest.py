@@ -0,0 +1,115 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from server import LatencyStats
+
+
+async def request(reader, writer, message):
+    writer.write(json.dumps(message).encode() + b"\n")
+    await writer.drain()
+
+    return json.loads(await reader.readline())
+
+
+async def client(host, port, games, size, difficulty, think, latency, results, rng):
+    """
+    This function is one simulated player: it plays its games one after the
+    other on one connection, drawing random free lines (and sometimes using
+    its power token), and times every request
+    """
+    reader, writer = await asyncio.open_connection(host, port, limit=1 << 16)
+
+    try:
+        for _ in range(games):
+            start = time.perf_counter()
+            state = await request(
+                reader, writer, {"op": "new", "size": size, "difficulty": difficulty}
+            )
+            latency.add(time.perf_counter() - start)
+
+            while state["ok"] and not state["over"]:
+                if think:
+                    await asyncio.sleep(rng.uniform(0, 2 * think))
+
+                if state["tokens"]["player"] and rng.random() < 0.2:
+                    message = {"op": "power", "action": "Extra Move"}
+                else:
+                    message = {"op": "move", "line": rng.choice(state["free"])}
+
+                start = time.perf_counter()
+                reply = await request(reader, writer, message)
+                latency.add(time.perf_counter() - start)
+                if reply["ok"]:
+                    state = reply
+                elif "state" in reply:
+                    state = reply["state"]  # A forfeit
+
+            results[state.get("winner", "error")] += 1
+    finally:
+        writer.close()
+
+
+async def run(args):
+    latency = LatencyStats()
+    results = {"player": 0, "ai": 0, "tie": 0, "error": 0}
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+
+    await asyncio.gather(
+        *(
+            client(
+                args.host,
+                args.port,
+                args.games,
+                args.size,
+                args.difficulty,
+                args.think,
+                latency,
+                results,
+                random.Random(rng.random()),
+            )
+            for _ in range(args.clients)
+        )
+    )
+    elapsed = time.perf_counter() - start
+
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    metrics = (await request(reader, writer, {"op": "metrics"}))["metrics"]
+    writer.close()
+
+    return {
+        "clients": args.clients,
+        "games": args.clients * args.games,
+        "seconds": round(elapsed, 3),
+        "games_per_sec": round(args.clients * args.games / elapsed, 2),
+        "results": results,
+        "client_latency": latency.summary(),
+        "server": metrics,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load-test a running server.py with many simulated players"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--games", type=int, default=1, help="games per client")
+    parser.add_argument("--size", type=int, default=4)
+    parser.add_argument("--difficulty", default="Medium")
+    parser.add_argument(
+        "--think", type=float, default=0.0, help="mean seconds a player thinks"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    json.dump(asyncio.run(run(args)), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,267 @@
+import random
+from bisect import bisect_left, insort
+from collections.abc import MutableMapping
+from functools import lru_cache
 from constants import Player
 
 
+def popcount(bits):
+    """
+    This function counts the set bits of a bitboard
+    """
+    return bin(bits).count("1")
+
+
+def iter_bits(bits):
+    """
+    This function yields the index of every set bit, lowest first
+    """
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+class BoardGeometry:
+    """
+    This class holds the line and box numbering for one grid size
+    Horizontal lines are numbered first (row by row), then vertical lines,
+    which is the same order get_possible_moves has always used
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.line_moves = []  # line index -> (x1, y1, x2, y2)
+        self.box_cells = []  # box index -> (x, y)
+
+        for y in range(size):
+            for x in range(size - 1):
+                self.line_moves.append((x, y, x + 1, y))
+
+        for y in range(size - 1):
+            for x in range(size):
+                self.line_moves.append((x, y, x, y + 1))
+
+        for y in range(size - 1):
+            for x in range(size - 1):
+                self.box_cells.append((x, y))
+
+        self.line_moves = tuple(self.line_moves)
+        self.box_cells = tuple(self.box_cells)
+        self.line_index = {mv: i for i, mv in enumerate(self.line_moves)}
+        self.box_index = {bx: i for i, bx in enumerate(self.box_cells)}
+        self.line_count = len(self.line_moves)
+        self.box_count = len(self.box_cells)
+        self.full_mask = (1 << self.line_count) - 1
+
+        # Each box is closed by its top, left, right and bottom lines
+        self.box_line_masks = tuple(
+            (1 << self.line_index[(x, y, x + 1, y)])
+            | (1 << self.line_index[(x, y, x, y + 1)])
+            | (1 << self.line_index[(x + 1, y, x + 1, y + 1)])
+            | (1 << self.line_index[(x, y + 1, x + 1, y + 1)])
+            for x, y in self.box_cells
+        )
+
+        # The boxes on either side of every line (one for border lines)
+        line_boxes = [[] for _ in range(self.line_count)]
+        for b, mask in enumerate(self.box_line_masks):
+            for i in iter_bits(mask):
+                line_boxes[i].append(b)
+        self.line_boxes = tuple(tuple(bs) for bs in line_boxes)
+
+        # The 8 symmetries of the square grid as (x, y) -> (x, y) dot mappings:
+        # identity, mirrors, half turn, transpose, quarter turns, anti-transpose
+        n = size - 1
+        transforms = (
+            lambda x, y: (x, y),
+            lambda x, y: (n - x, y),
+            lambda x, y: (x, n - y),
+            lambda x, y: (n - x, n - y),
+            lambda x, y: (y, x),
+            lambda x, y: (n - y, x),
+            lambda x, y: (y, n - x),
+            lambda x, y: (n - y, n - x),
+        )
+        self.line_perms = []  # line_perms[t][line] is the line it maps to
+        self.box_perms = []  # box_perms[t][box] is the box it maps to
+
+        for f in transforms:
+            perm = []
+            for x1, y1, x2, y2 in self.line_moves:
+                (a, b), (c, d) = sorted((f(x1, y1), f(x2, y2)))
+                perm.append(self.line_index[(a, b, c, d)])
+            self.line_perms.append(tuple(perm))
+
+            perm = []
+            for x, y in self.box_cells:
+                (a, b), (c, d) = f(x, y), f(x + 1, y + 1)
+                perm.append(self.box_index[(min(a, c), min(b, d))])
+            self.box_perms.append(tuple(perm))
+
+        self.line_perms = tuple(self.line_perms)
+        self.box_perms = tuple(self.box_perms)
+
+        # Zobrist keys, seeded by the size so hashes are the same in every process
+        rng = random.Random(size)
+        self.line_keys = tuple(rng.getrandbits(64) for _ in range(self.line_count))
+        # The keys of a line's image under all 8 symmetries, packed 64 bits each,
+        # so one XOR keeps the hash of every orientation of the board up to date
+        self.sym_line_keys = tuple(
+            sum(
+                self.line_keys[perm[i]] << (64 * t)
+                for t, perm in enumerate(self.line_perms)
+            )
+            for i in range(self.line_count)
+        )
+        self.side_key = rng.getrandbits(64)  # XORed in when the AI is to move
+        self.token_keys = {
+            Player.PLAYER: rng.getrandbits(64),
+            Player.AI: rng.getrandbits(64),
+        }  # XORed in while that player holds a token (at most one is stored)
+
+
+@lru_cache(maxsize=None)
+def board_geometry(size):
+    """
+    This function returns the (cached) geometry tables for a grid size
+    """
+    return BoardGeometry(size)
+
+
+class LinesView(MutableMapping):
+    """
+    This class exposes the line bitboards as the old {move: player} dict
+    So the drawing and power-up code in main.py keeps working unchanged
+    """
+
+    def __init__(self, game):
+        self._game = game
+
+    def __getitem__(self, move):
+        i = self._game.geometry.line_index.get(move)
+
+        if i is None or not self._game.drawn >> i & 1:
+            raise KeyError(move)
+
+        return Player.AI if self._game.ai_lines >> i & 1 else Player.PLAYER
+
+    def __setitem__(self, move, player):
+        game = self._game
+        i = game.geometry.line_index[move]
+        bit = 1 << i
+
+        if not game.drawn & bit:
+            game.line_hash ^= game.geometry.sym_line_keys[i]
+            del game.free_lines[bisect_left(game.free_lines, i)]
+            for b in game.geometry.line_boxes[i]:
+                game.side_counts[b] += 1
+        game.drawn |= bit
+        if player == Player.AI:
+            game.ai_lines |= bit
+        else:
+            game.ai_lines &= ~bit
+
+    def __delitem__(self, move):
+        if move not in self:
+            raise KeyError(move)
+
+        game = self._game
+        i = game.geometry.line_index[move]
+        bit = 1 << i
+        game.drawn &= ~bit
+        game.ai_lines &= ~bit
+        game.line_hash ^= game.geometry.sym_line_keys[i]
+        insort(game.free_lines, i)
+        for b in game.geometry.line_boxes[i]:
+            game.side_counts[b] -= 1
+
+    def __contains__(self, move):
+        i = self._game.geometry.line_index.get(move)
+
+        return i is not None and bool(self._game.drawn >> i & 1)
+
+    def __iter__(self):
+        moves = self._game.geometry.line_moves
+        return (moves[i] for i in iter_bits(self._game.drawn))
+
+    def __len__(self):
+        return popcount(self._game.drawn)
+
+
+class BoxesView(MutableMapping):
+    """
+    This class exposes the box bitboards as the old {box: player} dict
+    """
+
+    def __init__(self, game):
+        self._game = game
+
+    def __getitem__(self, box):
+        b = self._game.geometry.box_index.get(box)
+
+        if b is None or not self._game.claimed >> b & 1:
+            raise KeyError(box)
+
+        return Player.AI if self._game.ai_boxes >> b & 1 else Player.PLAYER
+
+    def __setitem__(self, box, player):
+        if box in self:
+            del self[box]
+
+        game = self._game
+        bit = 1 << game.geometry.box_index[box]
+
+        game.claimed |= bit
+        if player == Player.AI:
+            game.ai_boxes |= bit
+            game.ai_score += 1
+        else:
+            game.player_score += 1
+
+    def __delitem__(self, box):
+        if box not in self:
+            raise KeyError(box)
+
+        game = self._game
+        bit = 1 << game.geometry.box_index[box]
+        if game.ai_boxes & bit:
+            game.ai_score -= 1
+        else:
+            game.player_score -= 1
+        game.claimed &= ~bit
+        game.ai_boxes &= ~bit
+
+    def __contains__(self, box):
+        b = self._game.geometry.box_index.get(box)
+
+        return b is not None and bool(self._game.claimed >> b & 1)
+
+    def __iter__(self):
+        cells = self._game.geometry.box_cells
+        return (cells[b] for b in iter_bits(self._game.claimed))
+
+    def __len__(self):
+        return popcount(self._game.claimed)
+
+
 class DotsAndBoxesGame:
     def __init__(self, size):
         self.size = size  # This is the size of the grid
-        self.lines = {}  # This stores the lines drawn
-        self.boxes = {}  # This stores the boxes that are captured
+        self.geometry = board_geometry(size)  # This stores the line/box numbering
+        self.drawn = 0  # This is the bitboard of the lines drawn
+        self.ai_lines = 0  # This is the bitboard of the lines drawn by the AI
+        self.claimed = 0  # This is the bitboard of the boxes that are captured
+        self.ai_boxes = 0  # This is the bitboard of the boxes captured by the AI
+        self.line_hash = 0  # This is the Zobrist hash of the lines (all 8 orientations)
+        self.free_lines = list(
+            range(self.geometry.line_count)
+        )  # This is the sorted list of the lines not drawn yet
+        self.side_counts = bytearray(
+            self.geometry.box_count
+        )  # This stores how many sides of every box are drawn
+        self.ai_score = 0  # This stores the number of boxes captured by the AI
+        self.player_score = 0  # This stores the number of boxes captured by the player
         self.current_player = (
             Player.PLAYER
         )  # This stores the current player (defaults to Player, but first move is random)
@@ -20,10 +276,69 @@ class DotsAndBoxesGame:
             False  # This stores whether a power token was used this turn
         )
 
+    @property
+    def lines(self):
+        return LinesView(self)
+
+    @lines.setter
+    def lines(self, mapping):
+        # The bitboards are built directly: the incremental indexes (free lines,
+        # side counts) still describe the old lines until rebuild_indexes
+        line_index = self.geometry.line_index
+        mapping = dict(mapping)  # It may be a view of these very lines
+        self.drawn = self.ai_lines = 0
+        for move, player in mapping.items():
+            bit = 1 << line_index[move]
+            self.drawn |= bit
+            if player == Player.AI:
+                self.ai_lines |= bit
+        self.rebuild_indexes()
+
+    @property
+    def boxes(self):
+        return BoxesView(self)
+
+    @boxes.setter
+    def boxes(self, mapping):
+        box_index = self.geometry.box_index
+        mapping = dict(mapping)  # It may be a view of these very boxes
+        self.claimed = self.ai_boxes = 0
+        for box, player in mapping.items():
+            bit = 1 << box_index[box]
+            self.claimed |= bit
+            if player == Player.AI:
+                self.ai_boxes |= bit
+        self.rebuild_indexes()
+
+    def rebuild_indexes(self):
+        """
+        This function recomputes the hash, free lines, side counts and scores
+        from the bitboards, after they were replaced wholesale
+        """
+        geo = self.geometry
+        self.line_hash = 0
+        for i in iter_bits(self.drawn):
+            self.line_hash ^= geo.sym_line_keys[i]
+        self.free_lines = list(iter_bits(geo.full_mask & ~self.drawn))
+        self.side_counts = bytearray(
+            popcount(self.drawn & mask) for mask in geo.box_line_masks
+        )
+        self.ai_score = popcount(self.ai_boxes)
+        self.player_score = popcount(self.claimed) - self.ai_score
+
     def clone(self):
-        new_game = DotsAndBoxesGame(self.size)
-        new_game.lines = self.lines.copy()
-        new_game.boxes = self.boxes.copy()
+        new_game = DotsAndBoxesGame.__new__(DotsAndBoxesGame)
+        new_game.size = self.size
+        new_game.geometry = self.geometry
+        new_game.drawn = self.drawn
+        new_game.ai_lines = self.ai_lines
+        new_game.claimed = self.claimed
+        new_game.ai_boxes = self.ai_boxes
+        new_game.line_hash = self.line_hash
+        new_game.free_lines = self.free_lines.copy()
+        new_game.side_counts = self.side_counts.copy()
+        new_game.ai_score = self.ai_score
+        new_game.player_score = self.player_score
         new_game.current_player = self.current_player
         new_game.power_tokens = self.power_tokens.copy()
         new_game.turn_count = self.turn_count
@@ -33,14 +348,112 @@ class DotsAndBoxesGame:
 
         return new_game
 
+    def pack(self):
+        """
+        This function returns the state of the game as a small picklable tuple,
+        which is much cheaper to send to another process than the game and its
+        geometry tables; unpack rebuilds the game from it
+        """
+        return (
+            self.size,
+            self.drawn,
+            self.ai_lines,
+            self.claimed,
+            self.ai_boxes,
+            self.current_player,
+            self.power_tokens[Player.PLAYER],
+            self.power_tokens[Player.AI],
+            self.turn_count,
+            self.last_move,
+            self.last_move_done_by,
+            self.power_used_this_turn,
+        )
+
+    @classmethod
+    def unpack(cls, state):
+        game = cls(state[0])
+        (
+            _,
+            game.drawn,
+            game.ai_lines,
+            game.claimed,
+            game.ai_boxes,
+            game.current_player,
+            game.power_tokens[Player.PLAYER],
+            game.power_tokens[Player.AI],
+            game.turn_count,
+            game.last_move,
+            game.last_move_done_by,
+            game.power_used_this_turn,
+        ) = state
+        game.rebuild_indexes()
+
+        return game
+
+    def swap_sides(self):
+        """
+        This function returns a copy of the game with the player and the AI
+        swapped, so the AI's search can pick moves for the player's side too
+        """
+        other = {Player.PLAYER: Player.AI, Player.AI: Player.PLAYER}
+        new_game = self.clone()
+        new_game.ai_lines = self.drawn & ~self.ai_lines
+        new_game.ai_boxes = self.claimed & ~self.ai_boxes
+        new_game.ai_score = self.player_score
+        new_game.player_score = self.ai_score
+        new_game.current_player = other[self.current_player]
+        new_game.power_tokens = {other[p]: n for p, n in self.power_tokens.items()}
+        new_game.last_move_done_by = other.get(self.last_move_done_by)
+
+        return new_game
+
     def make_move(self, move):
-        self.lines[move] = self.current_player
+        return self.play(self.geometry.line_index[move])
+
+    def play(self, line):
+        """
+        This function draws a line given by its index
+        It is the bitboard version of make_move that the AI searches use directly
+        It returns an undo record that undo_move can take back
+        """
+        geo = self.geometry
+        undo = (
+            line,
+            self.drawn,
+            self.ai_lines,
+            self.claimed,
+            self.ai_boxes,
+            self.line_hash,
+            self.ai_score,
+            self.player_score,
+            self.power_tokens[Player.PLAYER],
+            self.power_tokens[Player.AI],
+            self.current_player,
+            self.turn_count,
+            self.last_move,
+            self.last_move_done_by,
+            self.power_used_this_turn,
+        )
+        bit = 1 << line
+        self.drawn |= bit
+        if self.current_player == Player.AI:
+            self.ai_lines |= bit
+        else:
+            self.ai_lines &= ~bit
+        self.line_hash ^= geo.sym_line_keys[line]
+        del self.free_lines[bisect_left(self.free_lines, line)]
         self.turn_count += 1
         claimed = False
 
-        for box in self.get_adjacent_boxes(move):
-            if self.is_box_completed(box) and box not in self.boxes:
-                self.boxes[box] = self.current_player
+        for box in geo.line_boxes[line]:
+            self.side_counts[box] += 1
+            if self.side_counts[box] == 4 and not self.claimed >> box & 1:
+                self.claimed |= 1 << box
+                if self.current_player == Player.AI:
+                    self.ai_boxes |= 1 << box
+                    self.ai_score += 1
+                else:
+                    self.player_score += 1
                 if self.power_tokens[self.current_player] == 0:
                     self.power_tokens[self.current_player] = 1
                 claimed = True
@@ -48,7 +461,7 @@ class DotsAndBoxesGame:
         if self.last_move_done_by != self.current_player:
             self.power_used_this_turn = False
 
-        self.last_move = move
+        self.last_move = geo.line_moves[line]
         self.last_move_done_by = self.current_player
 
         if not claimed:
@@ -56,57 +469,86 @@ class DotsAndBoxesGame:
                 Player.AI if self.current_player == Player.PLAYER else Player.PLAYER
             )
 
+        return undo
+
+    def undo_move(self, undo):
+        """
+        This function takes back a move using the record returned by make_move/play
+        Bitboards are immutable ints, so the record only holds references to them
+        """
+        (
+            line,
+            self.drawn,
+            self.ai_lines,
+            self.claimed,
+            self.ai_boxes,
+            self.line_hash,
+            self.ai_score,
+            self.player_score,
+            self.power_tokens[Player.PLAYER],
+            self.power_tokens[Player.AI],
+            self.current_player,
+            self.turn_count,
+            self.last_move,
+            self.last_move_done_by,
+            self.power_used_this_turn,
+        ) = undo
+        insort(self.free_lines, line)
+        for box in self.geometry.line_boxes[line]:
+            self.side_counts[box] -= 1
+
+    def zobrist_hash(self):
+        """
+        This function returns the Zobrist hash of the position
+        The line part is kept up to date incrementally; the side to move and
+        the tokens are folded in here since main.py sets them directly
+        """
+        geo = self.geometry
+        key = self.line_hash & 0xFFFFFFFFFFFFFFFF  # The board as it is oriented
+
+        if self.current_player == Player.AI:
+            key ^= geo.side_key
+        if self.power_tokens[Player.PLAYER] > 0:
+            key ^= geo.token_keys[Player.PLAYER]
+        if self.power_tokens[Player.AI] > 0:
+            key ^= geo.token_keys[Player.AI]
+
+        return key
+
     def is_box_completed(self, box):
-        x, y = box
-
-        return all(
-            [
-                ((x, y, x + 1, y)) in self.lines,
-                ((x, y, x, y + 1)) in self.lines,
-                ((x + 1, y, x + 1, y + 1)) in self.lines,
-                ((x, y + 1, x + 1, y + 1)) in self.lines,
-            ]
-        )
+        return self.side_counts[self.geometry.box_index[box]] == 4
 
-    def get_possible_moves(self):
-        moves = []
+    def completes_box(self, line):
+        """
+        This function tells whether drawing a line captures a box
+        """
+        return any(self.side_counts[b] == 3 for b in self.geometry.line_boxes[line])
 
-        for y in range(self.size):
-            for x in range(self.size - 1):
-                h = (x, y, x + 1, y)
-                if h not in self.lines:
-                    moves.append(h)
+    def gives_box(self, line):
+        """
+        This function tells whether drawing a line puts a third side on a box,
+        handing it to the opponent
+        """
+        return any(self.side_counts[b] == 2 for b in self.geometry.line_boxes[line])
 
-        for y in range(self.size - 1):
-            for x in range(self.size):
-                v = (x, y, x, y + 1)
-                if v not in self.lines:
-                    moves.append(v)
+    def get_possible_moves(self):
+        moves = self.geometry.line_moves
 
-        return moves
+        return [moves[i] for i in self.legal_lines()]
 
-    def get_adjacent_boxes(self, line):
-        x1, y1, x2, _ = line
-        boxes = []
+    def legal_lines(self):
+        """
+        This function returns the indices of the lines not drawn yet
+        """
+        return self.free_lines.copy()
 
-        if x1 == x2:
-            top_box = (x1 - 1, y1) if x1 > 0 else None
-            bottom_box = (x1, y1) if x1 < self.size - 1 else None
-        else:
-            top_box = (x1, y1 - 1) if y1 > 0 else None
-            bottom_box = (x1, y1) if y1 < self.size - 1 else None
-        if top_box:
-            boxes.append(top_box)
-        if bottom_box:
-            boxes.append(bottom_box)
+    def get_adjacent_boxes(self, line):
+        geo = self.geometry
 
-        return boxes
+        return [geo.box_cells[b] for b in geo.line_boxes[geo.line_index[line]]]
 
     def is_terminal(self):
-        return len(self.lines) >= 2 * self.size * (self.size - 1)
+        return not self.free_lines
 
     def evaluate(self):
-        player_score = sum(1 for v in self.boxes.values() if v == Player.PLAYER)
-        ai_score = sum(1 for v in self.boxes.values() if v == Player.AI)
-
-        return ai_score - player_score
+        return self.ai_score - self.player_score
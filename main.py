@@ -1,8 +1,16 @@
-import pygame, sys, math, random
-from logic import DotsAndBoxesGame
+import pygame, sys, math, random, argparse
+from functools import lru_cache, partial
+from logic import DotsAndBoxesGame, iter_bits
 from constants import Player, Colors, BUTTON_BACK_SIZE, CONFIRM_DIALOG_SIZE
-from minimax import minimax
-from alpha_beta_pruning import alpha_beta
+from ai import ai_turn
+from ai_worker import AIWorker, position_key
+from gamerecord import GameRecorder, append_record
+from mcts import MCTS
+from opening_book import OpeningBook
+from parallel_search import get_pool
+from powerups import PowerUps
+from search_stats import SearchStats, JsonlSink
+from transposition import TranspositionTable
 
 pygame.init()
 
@@ -10,6 +18,7 @@ FPS = 60
 LINE_WIDTH = 4
 DOT_RADIUS = 6
 MARGIN = 80
+HIT_RADIUS = 20  # How close (in pixels) a click must be to a line to draw it
 
 screen = pygame.display.set_mode((0, 0), pygame.RESIZABLE)
 SCREEN_WIDTH, SCREEN_HEIGHT = screen.get_size()
@@ -17,6 +26,26 @@ FONT = pygame.font.SysFont("Arial", 28)
 BTN_FONT = pygame.font.SysFont("Arial", 24)
 SMALL_FONT = pygame.font.SysFont("Arial", 18)
 TOKEN_FONT = pygame.font.SysFont("Arial", 14)
+stats_sink = None  # Set by --stats: where the AI's search statistics are written
+record_path = None  # Set by --record: the archive finished games are appended to
+event_driven = True  # Cleared by --poll: check for events every frame instead
+search_workers = None  # Set by --workers: the AI's search processes, if any
+AI_DONE = pygame.event.custom_type()  # Posted by the AI worker when a search ends
+REDRAW_EVENTS = (pygame.VIDEORESIZE, pygame.VIDEOEXPOSE)  # The window needs a repaint
+
+
+def next_events(timeout=None):
+    """
+    This function returns the pending events
+    In the event-driven mode it first sleeps until an event arrives (or timeout
+    milliseconds pass), so a window nobody touches uses no CPU
+    """
+    if not event_driven:
+        return pygame.event.get()
+
+    e = pygame.event.wait() if timeout is None else pygame.event.wait(max(1, timeout))
+
+    return ([] if e.type == pygame.NOEVENT else [e]) + pygame.event.get()
 
 
 def distance_point_to_segment(point, seg_start, seg_end):
@@ -36,6 +65,15 @@ def distance_point_to_segment(point, seg_start, seg_end):
     return math.hypot(x - proj[0], y - proj[1])
 
 
+@lru_cache(maxsize=1024)
+def render_text(font, text, color):
+    """
+    This function renders a text once and keeps the surface, since the same
+    labels and scores are drawn over and over (callers must not draw on it)
+    """
+    return font.render(text, True, color)
+
+
 def draw_text_button(surface, text, rect, hover=False):
     """
     This is a helper function that draws a button with text
@@ -44,46 +82,49 @@ def draw_text_button(surface, text, rect, hover=False):
 
     pygame.draw.rect(surface, col, rect, border_radius=10)
 
-    label = BTN_FONT.render(text, True, Colors.WHITE)
+    label = render_text(BTN_FONT, text, Colors.WHITE)
     surface.blit(label, label.get_rect(center=rect.center))
 
 
 def get_line_from_mouse(pos, grid_size, spacing, drawn, offset):
     """
     This function returns the line closest to the mouse position
+    Only the few lines that can be within HIT_RADIUS of the mouse are
+    measured: the rows and columns of the grid around it follow from the
+    position, spacing and offset directly
     """
-    ox, oy = offset
+    px, py = pos[0] - offset[0], pos[1] - offset[1]
+    lo_x, hi_x = (px - HIT_RADIUS) // spacing, (px + HIT_RADIUS) // spacing
+    lo_y, hi_y = (py - HIT_RADIUS) // spacing, (py + HIT_RADIUS) // spacing
     candidates = []
 
-    for r in range(grid_size):
-        for c in range(grid_size - 1):
-            s = (ox + c * spacing, oy + r * spacing)
-            e = (ox + (c + 1) * spacing, oy + r * spacing)
+    # Horizontal lines first, then vertical ones, row by row as they are numbered
+    for r in range(max(0, lo_y), min(grid_size - 1, hi_y) + 1):
+        for c in range(max(0, lo_x), min(grid_size - 2, hi_x) + 1):
             mv = (c, r, c + 1, r)
-
             if mv not in drawn:
-                candidates.append((distance_point_to_segment(pos, s, e), mv))
+                s, e = (c * spacing, r * spacing), ((c + 1) * spacing, r * spacing)
+                candidates.append((distance_point_to_segment((px, py), s, e), mv))
 
-    for r in range(grid_size - 1):
-        for c in range(grid_size):
-            s = (ox + c * spacing, oy + r * spacing)
-            e = (ox + c * spacing, oy + (r + 1) * spacing)
+    for r in range(max(0, lo_y), min(grid_size - 2, hi_y) + 1):
+        for c in range(max(0, lo_x), min(grid_size - 1, hi_x) + 1):
             mv = (c, r, c, r + 1)
-
             if mv not in drawn:
-                candidates.append((distance_point_to_segment(pos, s, e), mv))
+                s, e = (c * spacing, r * spacing), (c * spacing, (r + 1) * spacing)
+                candidates.append((distance_point_to_segment((px, py), s, e), mv))
 
     if not candidates:
         return None
 
     best = min(candidates, key=lambda x: x[0])
 
-    return best[1] if best[0] < 20 else None
+    return best[1] if best[0] < HIT_RADIUS else None
 
 
-def draw_power_panel(surface, panel_rect):
+def draw_power_panel(surface, panel_rect, hovered=None):
     """
     This function draws the power buttons and their info in the left side
+    hovered is the name of the button under the mouse, if any
     """
     actions = [
         ("Extra Move", "Keep turn without capture"),
@@ -92,7 +133,7 @@ def draw_power_panel(surface, panel_rect):
     ]
     btn_w, btn_h = panel_rect.width - 40, 50
     gap = 50
-    hdr = SMALL_FONT.render("POWER ACTIONS", True, Colors.BLACK)
+    hdr = render_text(SMALL_FONT, "POWER ACTIONS", Colors.BLACK)
 
     surface.blit(hdr, hdr.get_rect(center=(panel_rect.centerx, panel_rect.y + 40)))
 
@@ -103,10 +144,10 @@ def draw_power_panel(surface, panel_rect):
         r = pygame.Rect(panel_rect.x + 20, y0 + i * (btn_h + gap), btn_w, btn_h)
         buttons[name] = r
 
-        draw_text_button(surface, name, r, r.collidepoint(pygame.mouse.get_pos()))
+        draw_text_button(surface, name, r, name == hovered)
 
         for des in desc:
-            d = SMALL_FONT.render(des, True, Colors.BLACK)
+            d = render_text(SMALL_FONT, des, Colors.BLACK)
             surface.blit(d, (r.x + 10, r.bottom + 10))
             r = pygame.Rect(r.x + 10, r.bottom + 10, btn_w - 20, btn_h)
             r.height = d.get_height() + 5
@@ -121,15 +162,13 @@ def draw_score_panel(surface, game, panel_rect):
     It shows the number of boxes completed by each player
     And the number of tokens each player has
     """
-    hdr = SMALL_FONT.render("SCORE & TOKENS", True, Colors.BLACK)
+    hdr = render_text(SMALL_FONT, "SCORE & TOKENS", Colors.BLACK)
 
     surface.blit(hdr, hdr.get_rect(center=(panel_rect.centerx, panel_rect.y + 20)))
 
-    you_boxes = sum(v == Player.PLAYER for v in game.boxes.values())
-    ai_boxes = sum(v == Player.AI for v in game.boxes.values())
     lines = [
-        f"You: {you_boxes} boxes",
-        f"AI:  {ai_boxes} boxes",
+        f"You: {game.player_score} boxes",
+        f"AI:  {game.ai_score} boxes",
         "",
         f"You: {game.power_tokens[Player.PLAYER]} tokens",
         f"AI:  {game.power_tokens[Player.AI]} tokens",
@@ -137,7 +176,7 @@ def draw_score_panel(surface, game, panel_rect):
     y = panel_rect.y + 60
 
     for txt in lines:
-        surf = SMALL_FONT.render(txt, True, Colors.BLACK)
+        surf = render_text(SMALL_FONT, txt, Colors.BLACK)
         surface.blit(
             surf, (panel_rect.x + (panel_rect.width - surf.get_width()) // 2, y)
         )
@@ -159,74 +198,237 @@ def draw_info_panel(surface, panel_rect):
     y = panel_rect.y - 10
 
     for txt in lines:
-        surf = TOKEN_FONT.render(txt, True, Colors.BLACK)
+        surf = render_text(TOKEN_FONT, txt, Colors.BLACK)
         surface.blit(surf, (panel_rect.x + 10, y))
         y += surf.get_height() + 5
 
 
-def draw_board(win, game: DotsAndBoxesGame, grid_size):
+class BoardView:
     """
-    This function draws the game board
-    It draws the dots, lines, and boxes on the screen
-    It also draws the buttons, information and score info
+    This class draws the game board and only redraws what changed
+    The dots are rendered once into a background surface, and the lines and
+    boxes are added to an off-screen copy of it as they appear; every frame
+    compares the game's bitboards with what is drawn and repaints just the
+    rectangles that changed (new lines and boxes, the score panel, the power
+    button under the mouse, the thinking note), updating only those parts of
+    the display
+    A repaint copies the board and draws the buttons and panels on top,
+    clipped to the rectangle, so everything is layered as in a full redraw
+    Anything that can't be drawn on top (a line taken back by Line Reversal, or
+    something drawn over the board from outside) repaints the whole board
     """
-    spacing = min(
-        (SCREEN_WIDTH - 2 * MARGIN) // (grid_size - 1),
-        (SCREEN_HEIGHT - 2 * MARGIN) // (grid_size - 1),
-    )
-    bw, bh = spacing * (grid_size - 1), spacing * (grid_size - 1)
-    ox = (SCREEN_WIDTH - bw) // 2
-    oy = (SCREEN_HEIGHT - bh) // 2
 
-    win.fill(Colors.WHITE)
-
-    # This loop draws the dots
-    for ry in range(grid_size):
-        for cx in range(grid_size):
-            pygame.draw.circle(
-                win, Colors.BLACK, (ox + cx * spacing, oy + ry * spacing), DOT_RADIUS
-            )
+    def __init__(self, grid_size):
+        self.grid_size = grid_size
+        self.spacing = min(
+            (SCREEN_WIDTH - 2 * MARGIN) // (grid_size - 1),
+            (SCREEN_HEIGHT - 2 * MARGIN) // (grid_size - 1),
+        )
+        bw = bh = self.spacing * (grid_size - 1)
+        self.offset = ox, oy = ((SCREEN_WIDTH - bw) // 2, (SCREEN_HEIGHT - bh) // 2)
+
+        self.back = pygame.Rect(20, 20, *BUTTON_BACK_SIZE)
+        self.quitb = pygame.Rect(SCREEN_WIDTH - 220, 20, 200, 50)
+        self.power_pan = pygame.Rect(20, oy, 240, bh)
+        self.score_pan = pygame.Rect(SCREEN_WIDTH - 260, oy, 240, bh)
+        self.info_pan = pygame.Rect(SCREEN_WIDTH - 260, oy + bh + 20, 240, 60)
+        think = render_text(TOKEN_FONT, "AI is thinking...", Colors.BLACK)
+        self.think_pos = (SCREEN_WIDTH // 2 - 70, oy - think.get_height() - 15)
+        self.think_rect = think.get_rect(topleft=self.think_pos)
+        self.power_btns = draw_power_panel(
+            pygame.Surface((1, 1)), self.power_pan
+        )  # Only the button rectangles are needed here
+
+        # The dots never change, so they are drawn once
+        self.background = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+        self.background.fill(Colors.WHITE)
+        for ry in range(grid_size):
+            for cx in range(grid_size):
+                pygame.draw.circle(
+                    self.background,
+                    Colors.BLACK,
+                    (ox + cx * self.spacing, oy + ry * self.spacing),
+                    DOT_RADIUS,
+                )
 
-    # This loop draws the lines
-    for mv, owner in game.lines.items():
+        self.board = self.background.copy()  # Dots, lines and boxes
+        self.game = None
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        This function makes the next draw repaint the whole board, e.g. after
+        something else was drawn over it
+        """
+        self.drawn = None
+        self.score = None
+        self.hovered = None
+        self.hover_line = None
+        self.thinking_text = ""
+
+    def endpoints(self, mv):
         x1, y1, x2, y2 = mv
+        ox, oy = self.offset
+
+        return (
+            (ox + x1 * self.spacing, oy + y1 * self.spacing),
+            (ox + x2 * self.spacing, oy + y2 * self.spacing),
+        )
+
+    def line_rect(self, mv):
+        (x1, y1), (x2, y2) = self.endpoints(mv)
+
+        return pygame.Rect(x1, y1, x2 - x1 + 1, y2 - y1 + 1).inflate(
+            2 * LINE_WIDTH, 2 * LINE_WIDTH
+        )
+
+    def draw_line(self, game, line):
         col = (
-            Colors.PLAYER_LINE_COLOR if owner == Player.PLAYER else Colors.AI_LINE_COLOR
+            Colors.AI_LINE_COLOR
+            if game.ai_lines >> line & 1
+            else Colors.PLAYER_LINE_COLOR
         )  # Different colors of lines for player and AI
-        start = (ox + x1 * spacing, oy + y1 * spacing)
-        end = (ox + x2 * spacing, oy + y2 * spacing)
-        pygame.draw.line(win, col, start, end, LINE_WIDTH)
+        start, end = self.endpoints(game.geometry.line_moves[line])
+
+        return pygame.draw.line(self.board, col, start, end, LINE_WIDTH)
+
+    def add_line(self, game, line):
+        """
+        This function draws a new line onto the board and returns the area it
+        touched
+        Lines overlap at the dots, so drawn lines of a higher index meeting it
+        there are drawn again on top (clipped to the new line, so nothing else
+        moves), as drawing all lines in order would
+        """
+        x1, y1, x2, y2 = game.geometry.line_moves[line]
+        index = game.geometry.line_index
+        rect = self.draw_line(game, line)
+        above = set()
+
+        for x, y in ((x1, y1), (x2, y2)):
+            for mv in (
+                (x - 1, y, x, y),
+                (x, y, x + 1, y),
+                (x, y - 1, x, y),
+                (x, y, x, y + 1),
+            ):
+                i = index.get(mv)
+                if i is not None and i > line and game.drawn >> i & 1:
+                    above.add(i)
 
-    # This loop draws the boxes
-    for bx, owner in game.boxes.items():
-        x, y = bx
-        rect = pygame.Rect(
-            ox + x * spacing + LINE_WIDTH,
-            oy + y * spacing + LINE_WIDTH,
-            spacing - 2 * LINE_WIDTH,
-            spacing - 2 * LINE_WIDTH,
-        )
-        color = Colors.PINK if owner == Player.PLAYER else Colors.BLUE
+        self.board.set_clip(rect)
+        for i in sorted(above):
+            self.draw_line(game, i)
+        self.board.set_clip(None)
 
-        pygame.draw.rect(win, color, rect)
+        return rect
 
-    back = pygame.Rect(20, 20, *BUTTON_BACK_SIZE)
-    quitb = pygame.Rect(SCREEN_WIDTH - 220, 20, 200, 50)
+    def draw_box(self, game, box):
+        x, y = game.geometry.box_cells[box]
+        ox, oy = self.offset
+        rect = pygame.Rect(
+            ox + x * self.spacing + LINE_WIDTH,
+            oy + y * self.spacing + LINE_WIDTH,
+            self.spacing - 2 * LINE_WIDTH,
+            self.spacing - 2 * LINE_WIDTH,
+        )
+        color = Colors.BLUE if game.ai_boxes >> box & 1 else Colors.PINK
+
+        return pygame.draw.rect(self.board, color, rect)
+
+    def repaint(self, win, rect):
+        """
+        This function redraws one rectangle of the screen: the board, then the
+        buttons and panels over it
+        """
+        win.blit(self.board, rect, rect)
+        win.set_clip(rect)
+
+        if self.hover_line is not None:
+            start, end = self.endpoints(self.hover_line)
+            pygame.draw.line(win, Colors.HOVER_LINE_COLOR, start, end, LINE_WIDTH)
+
+        draw_text_button(win, "Back to Menu", self.back)
+        draw_text_button(win, "Quit", self.quitb)
+        draw_power_panel(win, self.power_pan, self.hovered)
+        draw_score_panel(win, self.game, self.score_pan)
+        draw_info_panel(win, self.info_pan)
+
+        if self.thinking_text:
+            text = render_text(TOKEN_FONT, self.thinking_text, Colors.BLACK)
+            win.blit(text, self.think_pos)
+
+        win.set_clip(None)
+
+        return rect
+
+    def draw(self, win, game, thinking=False, hover_line=None):
+        """
+        This function brings the board on screen up to date with the game
+        While the AI is searching (thinking) it also says so above the board,
+        and hover_line (a free line under the mouse) is highlighted
+        It returns the buttons, spacing and offset the event handling needs
+        """
+        self.game = game
+        full = (
+            self.drawn is None
+            or self.drawn & ~game.drawn
+            or self.claimed & ~game.claimed
+            or (self.ai_lines ^ game.ai_lines) & self.drawn
+            or (self.ai_boxes ^ game.ai_boxes) & self.claimed
+        )
 
-    draw_text_button(win, "Back to Menu", back)
-    draw_text_button(win, "Quit", quitb)
+        if full:
+            self.board = self.background.copy()
+            self.drawn = self.ai_lines = self.claimed = self.ai_boxes = 0
+
+        # Only the lines and boxes that are not drawn yet are added to the board
+        dirty = [self.add_line(game, l) for l in iter_bits(game.drawn & ~self.drawn)]
+        dirty += [
+            self.draw_box(game, b) for b in iter_bits(game.claimed & ~self.claimed)
+        ]
+        self.drawn, self.ai_lines = game.drawn, game.ai_lines
+        self.claimed, self.ai_boxes = game.claimed, game.ai_boxes
+
+        score = (
+            game.player_score,
+            game.ai_score,
+            game.power_tokens[Player.PLAYER],
+            game.power_tokens[Player.AI],
+        )
+        if score != self.score:
+            self.score = score
+            dirty.append(self.score_pan)
+
+        mouse = pygame.mouse.get_pos()
+        hovered = next(
+            (name for name, r in self.power_btns.items() if r.collidepoint(mouse)),
+            None,
+        )
+        if hovered != self.hovered:
+            dirty += [self.power_btns[n] for n in (self.hovered, hovered) if n]
+            self.hovered = hovered
 
-    left_pan = pygame.Rect(20, oy, 240, bh)
-    right_pan = pygame.Rect(SCREEN_WIDTH - 260, oy, 240, bh)
-    info_pan = pygame.Rect(SCREEN_WIDTH - 260, oy + bh + 20, 240, 60)
+        if hover_line is not None and hover_line in game.lines:
+            hover_line = None  # It was drawn in the meantime
+        if hover_line != self.hover_line:
+            dirty += [self.line_rect(mv) for mv in (self.hover_line, hover_line) if mv]
+            self.hover_line = hover_line
 
-    power_btns = draw_power_panel(win, left_pan)
-    draw_score_panel(win, game, right_pan)
-    draw_info_panel(win, info_pan)
+        text = ""
+        if thinking:
+            text = "AI is thinking" + "." * (pygame.time.get_ticks() // 400 % 3 + 1)
+        if text != self.thinking_text:
+            self.thinking_text = text
+            dirty.append(self.think_rect)
 
-    pygame.display.update()
+        if full:
+            self.repaint(win, win.get_rect())
+            pygame.display.update()
+        elif dirty:
+            pygame.display.update([self.repaint(win, rect) for rect in dirty])
 
-    return back, quitb, spacing, (ox, oy), power_btns
+        return self.back, self.quitb, self.spacing, self.offset, self.power_btns
 
 
 def confirm_dialog(msg):
@@ -237,33 +439,43 @@ def confirm_dialog(msg):
     r = pygame.Rect((SCREEN_WIDTH - w) // 2, (SCREEN_HEIGHT - h) // 2, w, h)
     yes = pygame.Rect(r.x + 60, r.bottom - 100, 140, 60)
     no = pygame.Rect(r.right - 200, r.bottom - 100, 140, 60)
+    under = screen.copy()  # This stores what the dialog covers, put back after
+    ov = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+    p = render_text(FONT, msg, Colors.WHITE)
+    shown = None  # This stores the hover state on screen (None: redraw)
 
-    while True:
-        ov = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
-
-        ov.set_alpha(180)
-        ov.fill(Colors.GRAY)
-        screen.blit(ov, (0, 0))
-        pygame.draw.rect(screen, Colors.BUTTON_COLOR, r, border_radius=10)
+    ov.set_alpha(180)
+    ov.fill(Colors.GRAY)
 
-        p = FONT.render(msg, True, Colors.WHITE)
+    while True:
+        mouse = pygame.mouse.get_pos()
+        hover = (yes.collidepoint(mouse), no.collidepoint(mouse))
 
-        screen.blit(p, p.get_rect(center=(r.centerx, r.y + 80)))
-        draw_text_button(screen, "Yes", yes, yes.collidepoint(pygame.mouse.get_pos()))
-        draw_text_button(screen, "No", no, no.collidepoint(pygame.mouse.get_pos()))
+        if hover != shown:
+            shown = hover
+            screen.blit(under, (0, 0))
+            screen.blit(ov, (0, 0))
+            pygame.draw.rect(screen, Colors.BUTTON_COLOR, r, border_radius=10)
+            screen.blit(p, p.get_rect(center=(r.centerx, r.y + 80)))
+            draw_text_button(screen, "Yes", yes, hover[0])
+            draw_text_button(screen, "No", no, hover[1])
 
-        pygame.display.update()
+            pygame.display.update()
 
-        for e in pygame.event.get():
+        for e in next_events():
             if e.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
 
+            if e.type in REDRAW_EVENTS:
+                shown = None
+
             if e.type == pygame.MOUSEBUTTONDOWN:
-                if yes.collidepoint(e.pos):
-                    return True
-                if no.collidepoint(e.pos):
-                    return False
+                for answer, btn in ((True, yes), (False, no)):
+                    if btn.collidepoint(e.pos):
+                        screen.blit(under, (0, 0))
+                        pygame.display.update()
+                        return answer
 
 
 def end_game_menu(grid_size, game: DotsAndBoxesGame, difficulty, algo_choice):
@@ -280,26 +492,33 @@ def end_game_menu(grid_size, game: DotsAndBoxesGame, difficulty, algo_choice):
 
     overlay.fill((100, 100, 100, 180))
     screen.blit(overlay, (0, 0))
+    shown = None  # This stores the hover state on screen (None: redraw)
 
     while True:
-        t = FONT.render(outcome, True, Colors.BLACK)
+        mouse = pygame.mouse.get_pos()
+        hover = (pb.collidepoint(mouse), mb.collidepoint(mouse), qb.collidepoint(mouse))
 
-        screen.blit(t, t.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 60)))
-        draw_text_button(
-            screen, "Play Again", pb, pb.collidepoint(pygame.mouse.get_pos())
-        )
-        draw_text_button(
-            screen, "Main Menu", mb, mb.collidepoint(pygame.mouse.get_pos())
-        )
-        draw_text_button(screen, "Quit", qb, qb.collidepoint(pygame.mouse.get_pos()))
+        if hover != shown:
+            shown = hover
+            t = render_text(FONT, outcome, Colors.BLACK)
 
-        pygame.display.update()
+            screen.blit(
+                t, t.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 60))
+            )
+            draw_text_button(screen, "Play Again", pb, hover[0])
+            draw_text_button(screen, "Main Menu", mb, hover[1])
+            draw_text_button(screen, "Quit", qb, hover[2])
+
+            pygame.display.update()
 
-        for e in pygame.event.get():
+        for e in next_events():
             if e.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
 
+            if e.type in REDRAW_EVENTS:
+                shown = None
+
             if e.type == pygame.MOUSEBUTTONDOWN:
                 if pb.collidepoint(e.pos):
                     game_loop(grid_size, difficulty, algo_choice)
@@ -322,126 +541,157 @@ def game_loop(grid_size, difficulty, algo_choice):
         "Medium": 2,
         "Hard": 3,
     }  # This maps the difficulty of the AI by limiting the depth of the minimax algorithm
+    budget_map = {
+        "Easy": {"time_budget": 0.2},
+        "Medium": {"time_budget": 0.5},
+        "Hard": {"time_budget": 1.5},
+        "Expert": {"time_budget": 2.0},
+    }  # Alpha-beta instead deepens until its think time (or node) budget per move is used
     ai_depth = depth_map.get(difficulty, 2)
+    ai_budget = budget_map.get(difficulty, budget_map["Medium"])
     ai_prob = {"Easy": 0.1, "Medium": 0.3, "Hard": 0.5}.get(
         difficulty, 0.3
     )  # This is the probability of AI using the power token according to the difficulty level
     clock = pygame.time.Clock()
+    view = BoardView(grid_size)  # This draws the board, redrawing only changes
+    table = TranspositionTable(
+        symmetric=True
+    )  # Shared by every alpha-beta search of this game, mirrored positions included
     game = DotsAndBoxesGame(grid_size)
     game.current_player = random.choice(
         [Player.PLAYER, Player.AI]
     )  # Make sure that the first move is random
-    extra_move = False
-    swap_count = 0
+    rules = PowerUps()  # This applies the power token rules for both sides
+    worker = AIWorker(
+        lambda: pygame.event.post(pygame.event.Event(AI_DONE))
+    )  # This runs the AI's searches off the pygame thread and wakes the loop up
+    thinking = False  # Whether the worker is searching the AI's move right now
+    pondering = None  # This stores the position the worker is pondering from
+    hover_line = None  # This stores the free line under the mouse, if any
+
+    engine = MCTS() if algo_choice == "mcts" else None  # Its tree lasts the game
+    book = (
+        OpeningBook.load(grid_size) if algo_choice != "minimax" else None
+    )  # Precomputed opening moves (see opening_book.py), if built for this size
+    stats = SearchStats(stats_sink) if stats_sink else None  # Real turns only
+    recorder = GameRecorder(game) if record_path else None  # Moves, power-ups, times
+
+    def decide(position, stop, stats=None):
+        return ai_turn(
+            position,
+            algo_choice,
+            ai_depth,
+            ai_budget,
+            ai_prob,
+            table,
+            stop,
+            stats,
+            engine,
+            search_workers,
+        )
 
     while True:
         clock.tick(FPS)
-        back_btn, quit_btn, spacing, offset, power_btns = draw_board(
-            screen, game, grid_size
+        back_btn, quit_btn, spacing, offset, power_btns = view.draw(
+            screen,
+            game,
+            thinking,
+            hover_line if game.current_player == Player.PLAYER else None,
         )
 
         # Check if all the lines are drawn in the grid
         if game.is_terminal():
+            worker.cancel()
+            if recorder is not None:
+                append_record(record_path, recorder.finish(game))
             end_game_menu(grid_size, game, difficulty, algo_choice)
             return
 
-        # AI's move
+        # AI's move: searched on the worker thread while this loop keeps drawing
         if game.current_player == Player.AI:
-            base_eval, _ = (
-                (alpha_beta if algo_choice == "alpha-beta" else minimax)(
-                    game,
-                    ai_depth,
-                    alpha=-float("inf"),
-                    beta=float("inf"),
-                    maximizing=True,
-                )
-                if algo_choice == "alpha-beta"
-                else minimax(game, ai_depth, True)
-            )
+            if not thinking:
+                worker.cancel()  # Stop pondering, the player has moved
+                pondering = None
+                book_move = book.lookup(game) if book is not None else None
+
+                if book_move is not None:
+                    decision = (None, book_move)  # No search needed
+                else:
+                    decision = worker.pondered.get(position_key(game))
+
+                if decision is None:
+                    worker.start(partial(decide, stats=stats), game.clone())
+                    thinking = True
+                    continue
+            elif worker.busy():
+                # Woken up by AI_DONE, or in time to animate the thinking note
+                for e in next_events(400 - pygame.time.get_ticks() % 400):
+                    if e.type == pygame.QUIT and confirm_dialog("Quit the game?"):
+                        pygame.quit()
+                        sys.exit()
+
+                    if e.type in REDRAW_EVENTS:
+                        view.invalidate()
+
+                    if e.type == AI_DONE and not worker.stop.is_set():
+                        worker.wait()  # The thread is just returning
+
+                    if e.type == pygame.MOUSEBUTTONDOWN:
+                        if back_btn.collidepoint(e.pos) and confirm_dialog(
+                            "Back to main menu?"
+                        ):
+                            worker.cancel()
+                            return
+
+                        if quit_btn.collidepoint(e.pos) and confirm_dialog(
+                            "Quit the game?"
+                        ):
+                            pygame.quit()
+                            sys.exit()
+
+                continue
+            else:
+                thinking = False
+                decision = worker.decision()
 
-            best_eval = base_eval
-            best_action = None  # Here None means no token should be used
+            best_action, best_move = decision
 
-            if (
-                game.power_tokens[Player.AI] >= 1
-                and not game.power_used_this_turn
-                and random.random() < ai_prob
-            ):
-                # Try each of the three power-ups
-                for action in ("Extra Move", "Line Reversal", "Swap Token"):
-                    ng = game.clone()
-
-                    if action == "Line Reversal":
-                        if ng.last_move and ng.lines.get(ng.last_move) != Player.AI:
-                            del ng.lines[ng.last_move]
-                            ng.power_tokens[Player.AI] -= 1
-                            ng.power_used_this_turn = True
-                            extra_move = False
-
-                    elif action == "Extra Move":
-                        extra_move = True
-                        ng.power_tokens[Player.AI] -= 1
-                        ng.power_used_this_turn = True
-                    elif action == "Swap Token":
-                        extra_move = False
-                        for _ in range(2):
-                            choices = ng.get_possible_moves()
-                            if not choices:
-                                break
-                            rm = random.choice(choices)
-                            ng.make_move(rm)
-                        ng.power_tokens[Player.AI] -= 1
-                        ng.power_used_this_turn = True
-                    else:
-                        continue
-
-                    if algo_choice == "alpha-beta":
-                        val, _ = alpha_beta(
-                            ng, ai_depth, -float("inf"), float("inf"), True
-                        )
-                    else:
-                        val, _ = minimax(ng, ai_depth, True)
-
-                    if val > best_eval:
-                        best_eval = val
-                        best_action = action
-
-            if best_action is not None:
-                game.power_used_this_turn = True
-
-                if best_action == "Extra Move":
-                    extra_move = True
-                elif best_action == "Line Reversal" and game.last_move:
-                    del game.lines[game.last_move]
-                elif best_action == "Swap Token":
-                    swap_count = 2
-
-            if algo_choice == "alpha-beta":
-                _, best_move = alpha_beta(
-                    game, ai_depth, -float("inf"), float("inf"), True
-                )
-            else:
-                _, best_move = minimax(game, ai_depth, True)
+            if best_action is not None and rules.use(game, Player.AI, best_action):
+                if recorder is not None:
+                    recorder.use(best_action)
 
             if best_move:
-                game.make_move(best_move)
-
-            if extra_move:
-                game.current_player = Player.AI
-                extra_move = False
+                swap = rules.play(game, best_move)
+                if recorder is not None:
+                    recorder.play(game, best_move, swap)
 
             continue
 
+        # While the player thinks, the worker works out replies to their likely moves
+        # (MCTS does not ponder: its kept tree already covers the likely replies)
+        if engine is None and pondering != position_key(game):
+            pondering = position_key(game)
+            worker.ponder(decide, game.clone())
+
         # Player's move
-        for e in pygame.event.get():
+        for e in next_events():
             if e.type == pygame.QUIT and confirm_dialog("Quit the game?"):
                 pygame.quit()
                 sys.exit()
 
+            if e.type in REDRAW_EVENTS:
+                view.invalidate()
+
+            if e.type == pygame.MOUSEMOTION:
+                hover_line = get_line_from_mouse(
+                    e.pos, grid_size, spacing, game.lines, offset
+                )
+
             if e.type == pygame.MOUSEBUTTONDOWN:
                 if back_btn.collidepoint(e.pos) and confirm_dialog(
                     "Back to main menu?"
                 ):
+                    worker.cancel()
                     return
 
                 if quit_btn.collidepoint(e.pos) and confirm_dialog("Quit the game?"):
@@ -449,62 +699,32 @@ def game_loop(grid_size, difficulty, algo_choice):
                     sys.exit()
 
                 for act, rect in power_btns.items():
-                    if (
-                        rect.collidepoint(e.pos)
-                        and game.power_tokens[Player.PLAYER] >= 1
-                        and not game.power_used_this_turn
-                    ):
-                        if act == "Line Reversal":
-                            if (
-                                game.last_move
-                                and game.lines.get(game.last_move) != Player.PLAYER
-                            ):
-                                del game.lines[game.last_move]
-                                game.power_tokens[Player.PLAYER] = 0
-                                game.power_used_this_turn = True
-                            else:
-                                err_msg = FONT.render(
-                                    "No valid line to reverse", True, Colors.RED
-                                )
-                                screen.blit(
-                                    err_msg,
-                                    (
-                                        SCREEN_WIDTH // 2 - err_msg.get_width() // 2,
-                                        SCREEN_HEIGHT // 2 - err_msg.get_height() // 2,
-                                    ),
-                                )
-                                pygame.display.update()
-                                pygame.time.delay(2000)
-
-                        if act == "Extra Move":
-                            extra_move = True
-                            game.power_tokens[Player.PLAYER] = 0
-                            game.power_used_this_turn = True
-
-                        elif act == "Swap Token":
-                            swap_count = 2
-                            game.power_tokens[Player.PLAYER] = 0
-                            game.power_used_this_turn = True
+                    if rect.collidepoint(e.pos) and rules.can_use(game, Player.PLAYER):
+                        if not rules.use(game, Player.PLAYER, act):
+                            err_msg = FONT.render(
+                                "No valid line to reverse", True, Colors.RED
+                            )
+                            screen.blit(
+                                err_msg,
+                                (
+                                    SCREEN_WIDTH // 2 - err_msg.get_width() // 2,
+                                    SCREEN_HEIGHT // 2 - err_msg.get_height() // 2,
+                                ),
+                            )
+                            pygame.display.update()
+                            pygame.time.delay(2000)
+                            view.invalidate()  # Repaint over the message
+                        elif recorder is not None:
+                            recorder.use(act)
 
                         break
 
                 mv = get_line_from_mouse(e.pos, grid_size, spacing, game.lines, offset)
 
                 if mv:
-                    game.make_move(mv)
-
-                    if extra_move:
-                        game.current_player = Player.PLAYER
-                        extra_move = False
-
-                    if swap_count > 0:
-                        swap_count -= 1
-                        avail = game.get_possible_moves()
-                        m2 = random.choice(avail)
-                        game.make_move(m2)
-                        game.current_player = Player.PLAYER
-
-        pygame.display.update()
+                    swap = rules.play(game, mv)
+                    if recorder is not None:
+                        recorder.play(game, mv, swap)
 
 
 def grid_size_menu(difficulty):
@@ -514,43 +734,48 @@ def grid_size_menu(difficulty):
     """
     clock = pygame.time.Clock()
     txt = ""
+    b5 = pygame.Rect(SCREEN_WIDTH // 2 - 150, 150, 100, 50)
+    b10 = pygame.Rect(SCREEN_WIDTH // 2 + 60, 150, 100, 50)
+    b15 = pygame.Rect(SCREEN_WIDTH // 2 - 45, 220, 100, 50)
+    box = pygame.Rect(SCREEN_WIDTH // 2 - 75, 300, 150, 50)
+    sub = pygame.Rect(SCREEN_WIDTH // 2 - 75, 400, 150, 50)
+    bb = pygame.Rect(20, SCREEN_HEIGHT - 70, 150, 50)
+    qb = pygame.Rect(SCREEN_WIDTH - 170, SCREEN_HEIGHT - 70, 150, 50)
+    shown = None  # This stores the hover state on screen (None: redraw)
 
     while True:
-        screen.fill(Colors.GRAY)
         mx, my = pygame.mouse.get_pos()
-        title = FONT.render(f"{difficulty} - Choose Grid Size", True, Colors.BLACK)
-        screen.blit(title, (SCREEN_WIDTH // 2 - title.get_width() // 2, 50))
-
-        b5 = pygame.Rect(SCREEN_WIDTH // 2 - 150, 150, 100, 50)
-        b10 = pygame.Rect(SCREEN_WIDTH // 2 + 60, 150, 100, 50)
-        b15 = pygame.Rect(SCREEN_WIDTH // 2 - 45, 220, 100, 50)
+        hover = tuple(b.collidepoint(mx, my) for b in (b5, b10, b15, sub, bb, qb))
 
-        draw_text_button(screen, "5", b5, b5.collidepoint(mx, my))
-        draw_text_button(screen, "10", b10, b10.collidepoint(mx, my))
-        draw_text_button(screen, "15", b15, b15.collidepoint(mx, my))
+        if hover != shown:
+            shown = hover
+            screen.fill(Colors.GRAY)
+            title = render_text(FONT, f"{difficulty} - Choose Grid Size", Colors.BLACK)
+            screen.blit(title, (SCREEN_WIDTH // 2 - title.get_width() // 2, 50))
 
-        box = pygame.Rect(SCREEN_WIDTH // 2 - 75, 300, 150, 50)
-        pygame.draw.rect(screen, Colors.WHITE, box)
+            draw_text_button(screen, "5", b5, hover[0])
+            draw_text_button(screen, "10", b10, hover[1])
+            draw_text_button(screen, "15", b15, hover[2])
 
-        lbl = FONT.render(txt, True, Colors.BLACK)
-        screen.blit(lbl, (box.x + 10, box.y + 10))
+            pygame.draw.rect(screen, Colors.WHITE, box)
 
-        pygame.draw.rect(screen, Colors.BLACK, box, 2)
-        allowed = FONT.render("Allowed: 3-20", True, Colors.BLACK)
-        screen.blit(allowed, (SCREEN_WIDTH // 2 - allowed.get_width() // 2, 360))
+            lbl = FONT.render(txt, True, Colors.BLACK)
+            screen.blit(lbl, (box.x + 10, box.y + 10))
 
-        sub = pygame.Rect(SCREEN_WIDTH // 2 - 75, 400, 150, 50)
-        draw_text_button(screen, "Submit", sub, sub.collidepoint(mx, my))
+            pygame.draw.rect(screen, Colors.BLACK, box, 2)
+            allowed = render_text(FONT, "Allowed: 3-20", Colors.BLACK)
+            screen.blit(allowed, (SCREEN_WIDTH // 2 - allowed.get_width() // 2, 360))
 
-        bb = pygame.Rect(20, SCREEN_HEIGHT - 70, 150, 50)
-        qb = pygame.Rect(SCREEN_WIDTH - 170, SCREEN_HEIGHT - 70, 150, 50)
+            draw_text_button(screen, "Submit", sub, hover[3])
+            draw_text_button(screen, "Back", bb, hover[4])
+            draw_text_button(screen, "Quit", qb, hover[5])
 
-        draw_text_button(screen, "Back", bb, bb.collidepoint(mx, my))
-        draw_text_button(screen, "Quit", qb, qb.collidepoint(mx, my))
+            pygame.display.update()
 
-        pygame.display.update()
+        for e in next_events():
+            if e.type != pygame.MOUSEMOTION:
+                shown = None  # Typing, clicks and window events all redraw
 
-        for e in pygame.event.get():
             if e.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
@@ -589,27 +814,36 @@ def main_menu():
     And the grid size for the game
     """
     clock = pygame.time.Clock()
-    diffs = ["Easy", "Medium", "Hard"]  # Difficulties
+    diffs = ["Easy", "Medium", "Hard", "Expert"]  # Difficulties
+    btns = [
+        (pygame.Rect(SCREEN_WIDTH // 2 - 150, 150 + i * 70, 300, 60), d)
+        for i, d in enumerate(diffs)
+    ]
+    # Quit button
+    qb = pygame.Rect(SCREEN_WIDTH // 2 - 150, 150 + len(diffs) * 70, 300, 60)
+    shown = None  # This stores the hover state on screen (None: redraw)
 
     while True:
-        screen.fill(Colors.GRAY)  # For the background color
         mx, my = pygame.mouse.get_pos()  # Get mouse position
-        title = FONT.render("Select Difficulty", True, Colors.BLACK)
+        hover = tuple(r.collidepoint(mx, my) for r, _ in btns + [(qb, "Quit")])
+
+        if hover != shown:
+            shown = hover
+            screen.fill(Colors.GRAY)  # For the background color
+            title = render_text(FONT, "Select Difficulty", Colors.BLACK)
 
-        screen.blit(title, (SCREEN_WIDTH // 2 - title.get_width() // 2, 50))
-        btns = []
+            screen.blit(title, (SCREEN_WIDTH // 2 - title.get_width() // 2, 50))
 
-        for i, d in enumerate(diffs):
-            r = pygame.Rect(SCREEN_WIDTH // 2 - 150, 150 + i * 70, 300, 60)
-            btns.append((r, d))
-            draw_text_button(screen, d, r, r.collidepoint(mx, my))
+            for (r, d), hovered in zip(btns, hover):
+                draw_text_button(screen, d, r, hovered)
 
-        # Quit button
-        qb = pygame.Rect(SCREEN_WIDTH // 2 - 150, 150 + len(diffs) * 70, 300, 60)
-        draw_text_button(screen, "Quit", qb, qb.collidepoint(mx, my))
-        pygame.display.update()
+            draw_text_button(screen, "Quit", qb, hover[-1])
+            pygame.display.update()
+
+        for e in next_events():
+            if e.type != pygame.MOUSEMOTION:
+                shown = None  # Clicks (and coming back from a game) and window events redraw
 
-        for e in pygame.event.get():
             # If the user closes the window, exit the game (this avoids the unnecessary crash which we figured out was happening when the game ended)
             if e.type == pygame.QUIT:
                 pygame.quit()
@@ -624,6 +858,8 @@ def main_menu():
                         if sz:
                             if d == "Easy":
                                 algo = "minimax"
+                            elif d == "Expert":
+                                algo = "mcts"
                             else:
                                 algo = "alpha-beta"
 
@@ -639,4 +875,34 @@ def main_menu():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dynamic Dots and Boxes")
+    parser.add_argument(
+        "--stats", metavar="FILE", help="append the AI's search statistics (JSONL)"
+    )
+    parser.add_argument(
+        "--record",
+        metavar="FILE",
+        help="append every finished game to a record archive",
+    )
+    parser.add_argument(
+        "--poll",
+        action="store_true",
+        help="check for events every frame instead of sleeping until one arrives",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        metavar="N",
+        help="split the AI's root moves across N search processes",
+    )
+    args = parser.parse_args()
+    if args.stats:
+        stats_sink = JsonlSink(args.stats)
+    record_path = args.record
+    event_driven = not args.poll
+    search_workers = args.workers
+    if search_workers:
+        # The pool forks its processes, so it starts before the AI's thread
+        get_pool(search_workers)
+
     main_menu()
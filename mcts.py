@@ -0,0 +1,238 @@
+import math
+import random
+import time
+from constants import Player
+from endgame import solve as solve_endgame
+from move_ordering import MoveOrderer
+
+EXPLORATION = 1.4  # The UCT exploration constant (sqrt(2) for 0/1 rewards)
+ITERATIONS = 1000  # Playouts per move when no budget is given
+REUSE_PLIES = 6  # How many lines may be drawn between two turns for tree reuse
+SAFE_TRIES = 4  # Random lines a heuristic rollout tries to find a safe one
+
+
+class Node:
+    """
+    This class is one node of the search tree
+    reward is the total playout reward of the player who drew move (the side
+    to move at the parent), so parents pick children by their own reward
+    """
+
+    __slots__ = ("move", "player", "parent", "children", "untried", "visits", "reward")
+
+    def __init__(self, move, player, parent, untried):
+        self.move = move  # The line drawn to get here (None at the root)
+        self.player = player  # The side that drew it
+        self.parent = parent
+        self.children = []
+        self.untried = untried  # Lines not expanded yet, the most promising last
+        self.visits = 0
+        self.reward = 0.0
+
+    def best_child(self, exploration):
+        log_visits = math.log(self.visits)
+
+        return max(
+            self.children,
+            key=lambda c: c.reward / c.visits
+            + exploration * math.sqrt(log_visits / c.visits),
+        )
+
+
+def _expansion_order(game, rng):
+    """
+    This function returns the free lines in the order they are expanded in
+    (popped from the end): box-completing lines first, sacrifices last and the
+    rest shuffled in between
+    """
+    completing, sacrifices = MoveOrderer.classify(game)
+    lines = game.legal_lines()
+    rng.shuffle(lines)
+    lines.sort(key=lambda l: (completing >> l & 1) - (sacrifices >> l & 1))
+
+    return lines
+
+
+def _free_side(game, box):
+    free = game.geometry.box_line_masks[box] & ~game.drawn
+
+    return (free & -free).bit_length() - 1
+
+
+def rollout(game, rng, heuristic=True):
+    """
+    This function plays the game out in place and returns the final score
+    (the AI's boxes minus the player's)
+    Random rollouts draw any free line; heuristic rollouts take every box the
+    last line offered and otherwise try a few random lines for one that gives
+    no box away, which plays far more like a real game at almost the same speed
+    Once a heuristic rollout finds no safe line it asks the endgame solver, and
+    a loony endgame is scored exactly instead of played out at random
+    """
+    geo = game.geometry
+    counts = game.side_counts
+    line = None
+
+    while game.free_lines:
+        move = None
+
+        if heuristic:
+            if line is not None:
+                for box in geo.line_boxes[line]:
+                    if counts[box] == 3:
+                        move = _free_side(game, box)
+                        break
+
+            if move is None:
+                for _ in range(SAFE_TRIES):
+                    move = rng.choice(game.free_lines)
+                    if not game.gives_box(move):
+                        break
+                else:
+                    solved = solve_endgame(game)
+                    if solved is not None:
+                        value = solved[0]
+                        if game.current_player != Player.AI:
+                            value = -value
+                        return game.evaluate() + value
+
+        if move is None:
+            move = rng.choice(game.free_lines)
+
+        game.play(move)
+        line = move
+
+    return game.evaluate()
+
+
+class MCTS:
+    """
+    This class is a Monte Carlo Tree Search (UCT) engine
+    Every playout walks down the tree by the UCT rule, adds one node, plays
+    the rest of the game out with a rollout and backs the result up (1 for a
+    win, 0.5 for a tie, 0 for a loss)
+    The tree is kept between turns: the next search starts from the node the
+    game actually reached, with all the playouts already spent below it
+    """
+
+    def __init__(self, exploration=EXPLORATION, heuristic=True, seed=None):
+        self.exploration = exploration
+        self.heuristic = heuristic  # Heuristic (True) or plain random rollouts
+        self.rng = random.Random(seed)
+        self.root = None
+        self.root_game = None  # The position at the root of the tree
+        self.last_search = {}  # Playouts, seconds, playouts/second of the last search
+
+    def _reuse(self, game):
+        """
+        This function moves the root down to the node of game, if the tree
+        has it (the lines drawn since the last search lead there), or drops
+        the tree
+        """
+        if self.root is not None and self.root_game.size == game.size:
+            new_lines = game.drawn & ~self.root_game.drawn
+            if (
+                self.root_game.drawn & ~game.drawn == 0
+                and bin(new_lines).count("1") <= REUSE_PLIES
+            ):
+                node = self._find(self.root, self.root_game.clone(), game, new_lines)
+                if node is not None:
+                    node.parent = None
+                    self.root, self.root_game = node, game.clone()
+                    return
+
+        self.root = Node(None, None, None, _expansion_order(game, self.rng))
+        self.root_game = game.clone()
+
+    def _find(self, node, position, game, new_lines):
+        if not new_lines:
+            same = (
+                position.claimed == game.claimed
+                and position.ai_boxes == game.ai_boxes
+                and position.ai_lines == game.ai_lines
+                and position.current_player == game.current_player
+            )
+            return node if same else None
+
+        for child in node.children:
+            if new_lines >> child.move & 1:
+                undo = position.play(child.move)
+                found = self._find(
+                    child, position, game, new_lines & ~(1 << child.move)
+                )
+                position.undo_move(undo)
+                if found is not None:
+                    return found
+
+        return None
+
+    def search(self, game, time_budget=None, iterations=None, stop=None):
+        """
+        This function searches game until the time budget or the number of
+        playouts is used up (or stop, a threading.Event, is set) and returns
+        the move with the most visits
+        Loony endgames are answered by the exact solver instead
+        """
+        solved = solve_endgame(game)
+        if solved is not None:
+            self.last_search = {"playouts": 0, "seconds": 0.0, "solved": True}
+            return game.geometry.line_moves[solved[1]]
+
+        if time_budget is None and iterations is None:
+            iterations = ITERATIONS
+
+        self._reuse(game)
+        reused = self.root.visits
+        start = time.perf_counter()
+        deadline = None if time_budget is None else start + time_budget
+        playouts = 0
+
+        while iterations is None or playouts < iterations:
+            if playouts % 16 == 0 and self.root.children:
+                if deadline is not None and time.perf_counter() > deadline:
+                    break
+                if stop is not None and stop.is_set():
+                    break
+
+            self._playout()
+            playouts += 1
+
+        elapsed = time.perf_counter() - start
+        self.last_search = {
+            "playouts": playouts,
+            "seconds": round(elapsed, 6),
+            "playouts_per_sec": round(playouts / elapsed) if elapsed else None,
+            "reused_visits": reused,
+        }
+
+        best = max(self.root.children, key=lambda c: c.visits)
+
+        return game.geometry.line_moves[best.move]
+
+    def _playout(self):
+        node = self.root
+        game = self.root_game.clone()
+
+        # Selection: follow UCT while every line of the node has a child
+        while not node.untried and node.children:
+            node = node.best_child(self.exploration)
+            game.play(node.move)
+
+        # Expansion: add one child for a line not tried yet
+        if node.untried:
+            line = node.untried.pop()
+            player = game.current_player
+            game.play(line)
+            child = Node(line, player, node, _expansion_order(game, self.rng))
+            node.children.append(child)
+            node = child
+
+        result = rollout(game, self.rng, self.heuristic)
+
+        # Backpropagation, each node scored for the side that drew its line
+        while node is not None:
+            node.visits += 1
+            if node.player is not None:
+                won = result if node.player == Player.AI else -result
+                node.reward += 1.0 if won > 0 else 0.5 if won == 0 else 0.0
+            node = node.parent
@@ -1,43 +1,59 @@
 from constants import Player
 
 
-def minimax(game, depth, maximizing):
+def minimax(game, depth, maximizing, in_place=False, limits=None, stats=None):
     """
     This function implements the minimax algorithm
+    It works on the line indices of the bitboard and makes/unmakes moves on one
+    game state, so a search only allocates an undo record per level
+    Unless in_place is set, the caller's game is cloned once so it is never touched
+    With limits (see iterative_deepening.SearchLimits) the search can be stopped
+    and with stats (see search_stats.SearchStats) the nodes are counted
     """
+    if limits is not None:
+        limits.tick()
+    if stats is not None:
+        stats.node(depth)
+
     if depth == 0 or game.is_terminal():
         return game.evaluate(), None
 
+    if not in_place:
+        game = game.clone()
+
     best_move = None
 
     if maximizing:
         max_eval = float("-inf")
 
-        for move in game.get_possible_moves():
-            new_game = game.clone()  # Create a new game state
-            new_game.make_move(move)  # Add the new move in the game state
-            eval = minimax(new_game, depth - 1, new_game.current_player == Player.AI)[
-                0
-            ]  # Now check the optimality of the new game state
+        for line in game.legal_lines():
+            undo = game.play(line)  # Add the new move in the game state
+            # Now check the optimality of the new game state
+            eval = minimax(
+                game, depth - 1, game.current_player == Player.AI, True, limits, stats
+            )[0]
+            game.undo_move(undo)  # And take the move back again
 
             if eval > max_eval:
                 max_eval = eval
-                best_move = move
+                best_move = line
 
-        return max_eval, best_move
+        return max_eval, game.geometry.line_moves[best_move]
 
     else:
         min_eval = float("inf")
 
-        for move in game.get_possible_moves():
-            new_game = (
-                game.clone()
+        for line in game.legal_lines():
+            undo = game.play(
+                line
             )  # Same thing as above, just this time the algorithm is minimizing
-            new_game.make_move(move)
-            eval = minimax(new_game, depth - 1, new_game.current_player == Player.AI)[0]
+            eval = minimax(
+                game, depth - 1, game.current_player == Player.AI, True, limits, stats
+            )[0]
+            game.undo_move(undo)
 
             if eval < min_eval:
                 min_eval = eval
-                best_move = move
+                best_move = line
 
-        return min_eval, best_move
+        return min_eval, game.geometry.line_moves[best_move]
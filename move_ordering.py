@@ -0,0 +1,66 @@
+class MoveOrderer:
+    """
+    This class orders the moves of an alpha-beta node so cutoffs come early
+    Moves are tried in this order:
+    1. The transposition table move (best move of an earlier search)
+    2. Box-completing moves
+    3. Killer moves (recent cutoff moves at the same depth) that are not sacrifices
+    4. Neutral moves that do not give the opponent a third side
+    5. Sacrifices (moves that put a third side on a box)
+    Within each group, moves that caused many cutoffs before (history) go first
+    """
+
+    def __init__(self, line_count):
+        self.history = [0] * line_count  # Cutoff score per line index
+        self.killers = {}  # depth -> [most recent killer, older killer]
+
+    @staticmethod
+    def classify(game):
+        """
+        This function returns two bitmasks of free lines: the lines that complete
+        a box, and the lines that would put a third side on a box
+        """
+        masks = game.geometry.box_line_masks
+        completing = 0
+        sacrifices = 0
+
+        for b, sides in enumerate(game.side_counts):
+            if sides == 3:
+                completing |= masks[b]
+            elif sides == 2:
+                sacrifices |= masks[b]
+
+        free = ~game.drawn
+        return completing & free, sacrifices & ~completing & free
+
+    def order(self, game, moves, depth, tt_move=None):
+        completing, sacrifices = self.classify(game)
+        killers = self.killers.get(depth, ())
+        history = self.history
+
+        def rank(line):
+            if line == tt_move:
+                group = 0
+            elif completing >> line & 1:
+                group = 1
+            elif sacrifices >> line & 1:
+                group = 4
+            elif line in killers:
+                group = 2
+            else:
+                group = 3
+
+            return group, -history[line]
+
+        return sorted(moves, key=rank)
+
+    def record_cutoff(self, line, depth):
+        """
+        This function is called when a move causes a beta (or alpha) cutoff
+        """
+        self.history[line] += depth * depth
+        killers = self.killers.setdefault(depth, [])
+
+        if line not in killers:
+            killers.insert(0, line)
+            del killers[2:]
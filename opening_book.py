@@ -0,0 +1,228 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from ai import deepen_turn, root_alternatives
+from constants import Player
+from logic import DotsAndBoxesGame
+from symmetry import canonical_hash, from_canonical, to_canonical
+from transposition import TranspositionTable
+
+BOOK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "books")
+PLIES = 3  # Lines drawn before the book hands over to the search
+NODE_BUDGET = 200000  # Alpha-beta nodes searched per book position
+
+# File layout: a header, then a power-of-two array of fixed-size slots that is
+# probed in place (open addressing, linear probing), so a lookup reads one or
+# two slots of the memory-mapped file and nothing is loaded up front
+MAGIC = b"DOTBOOK1"
+HEADER = struct.Struct("<8sHHIQ")  # magic, grid size, plies, entries, slots
+SLOT = struct.Struct("<QHhHxx")  # key, canonical line, value, depth
+EMPTY = 0xFFFF  # The line of an unused slot
+
+
+def book_path(size, directory=BOOK_DIR):
+    return os.path.join(directory, f"book_{size}.bin")
+
+
+def write_book(path, size, plies, entries):
+    """
+    This function writes entries (key -> (canonical line, value, depth)) to a
+    book file, with at least twice as many slots as entries
+    """
+    slots = 1
+    while slots < 2 * len(entries):
+        slots *= 2
+
+    data = bytearray(HEADER.size + slots * SLOT.size)
+    HEADER.pack_into(data, 0, MAGIC, size, plies, len(entries), slots)
+    for i in range(slots):
+        SLOT.pack_into(data, HEADER.size + i * SLOT.size, 0, EMPTY, 0, 0)
+
+    for key, (line, value, depth) in entries.items():
+        i = key & (slots - 1)
+        while SLOT.unpack_from(data, HEADER.size + i * SLOT.size)[1] != EMPTY:
+            i = (i + 1) & (slots - 1)
+        SLOT.pack_into(data, HEADER.size + i * SLOT.size, key, line, value, depth)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+class OpeningBook:
+    """
+    This class reads an opening book file through mmap
+    Positions are keyed by their canonical hash (see symmetry.canonical_hash),
+    so one entry answers all 8 rotations/mirrors of a position, and the move is
+    stored in the canonical orientation
+    Only positions without captured boxes are in the book; anything else (and
+    anything past its plies) is left to the search
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.size, self.plies, self.count, self.slots = HEADER.unpack_from(
+            self.data, 0
+        )
+
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not an opening book")
+
+    @classmethod
+    def load(cls, size, directory=BOOK_DIR):
+        """
+        This function opens the book of a grid size, or returns None if there
+        is none
+        """
+        path = book_path(size, directory)
+
+        return cls(path) if os.path.exists(path) else None
+
+    def probe(self, key):
+        """
+        This function returns (canonical line, value, depth) for a key, or None
+        """
+        i = key & (self.slots - 1)
+
+        while True:
+            slot_key, line, value, depth = SLOT.unpack_from(
+                self.data, HEADER.size + i * SLOT.size
+            )
+            if line == EMPTY:
+                return None
+            if slot_key == key:
+                return line, value, depth
+            i = (i + 1) & (self.slots - 1)
+
+    def lookup(self, game):
+        """
+        This function returns the book move of the position as a move tuple, or
+        None if the book does not have it
+        """
+        if game.size != self.size or game.claimed:
+            return None
+
+        key, t = canonical_hash(game)
+        entry = self.probe(key)
+        if entry is None:
+            return None
+
+        line = from_canonical(game, t, entry[0])
+        if game.drawn >> line & 1:
+            return None  # A hash collision with some other position
+
+        return game.geometry.line_moves[line]
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+def _replay(size, first, path):
+    game = DotsAndBoxesGame(size)
+    game.current_player = first
+    for line in path:
+        game.play(line)
+
+    return game
+
+
+def _search_position(size, first, path, node_budget):
+    """
+    This function searches one book position (the lines of path drawn from an
+    empty board on which first moved first) and returns its entry
+    """
+    game = _replay(size, first, path)
+    value, _, move, depth = deepen_turn(
+        root_alternatives(game, use_power=False),
+        node_budget=node_budget,
+        table=TranspositionTable(symmetric=True),
+    )
+    key, t = canonical_hash(game)
+    line = game.geometry.line_index[move]
+
+    return key, to_canonical(game, t, line), line, value, depth
+
+
+def build_book(size, plies=PLIES, node_budget=NODE_BUDGET, workers=None, log=None):
+    """
+    This function searches every position the AI can face in the first plies
+    of a game, whoever moves first, and returns the book entries
+    (key -> (canonical line, value, depth))
+    The AI's own moves follow the book, so only the player's replies branch;
+    symmetric copies of a position are searched once
+    """
+    entries = {}
+    frontier = [(first, ()) for first in (Player.AI, Player.PLAYER)]
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for ply in range(plies):
+            searches = []  # (first, path, future) of every AI position
+            next_frontier = []
+            seen = set()
+
+            for first, path in frontier:
+                game = _replay(size, first, path)
+                if game.claimed or game.is_terminal():
+                    continue
+
+                key, _ = canonical_hash(game)
+                if key in seen:
+                    continue
+                seen.add(key)
+
+                if game.current_player == Player.AI:
+                    future = pool.submit(
+                        _search_position, size, first, path, node_budget
+                    )
+                    searches.append((first, path, future))
+                else:
+                    next_frontier += [(first, path + (l,)) for l in game.legal_lines()]
+
+            for first, path, future in searches:
+                key, canonical, line, value, depth = future.result()
+                entries[key] = (canonical, value, depth)
+                next_frontier.append((first, path + (line,)))
+
+            frontier = next_frontier
+            if log is not None:
+                log(f"size {size} ply {ply}: {len(searches)} positions searched")
+
+    return entries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Precompute the AI's opening moves for some grid sizes with "
+        "deep alpha-beta searches and write one book file per size"
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[3, 4, 5])
+    parser.add_argument("--plies", type=int, default=PLIES)
+    parser.add_argument("--nodes", type=int, default=NODE_BUDGET)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--dir", default=BOOK_DIR)
+    args = parser.parse_args(argv)
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    for size in args.sizes:
+        start = time.perf_counter()
+        entries = build_book(size, args.plies, args.nodes, args.workers, log)
+        path = book_path(size, args.dir)
+        write_book(path, size, args.plies, entries)
+        print(
+            f"{path}: {len(entries)} positions in "
+            f"{time.perf_counter() - start:.1f}s",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
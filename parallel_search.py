@@ -0,0 +1,377 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+from alpha_beta_pruning import alpha_beta
+from constants import Player
+from endgame import solve as solve_endgame
+from iterative_deepening import SearchLimits, SearchTimeout
+from logic import DotsAndBoxesGame, board_geometry
+from minimax import minimax
+from move_ordering import MoveOrderer
+from pvs import pvs
+from search_stats import SearchStats
+from tablebase import probe as probe_tablebase
+from transposition import TranspositionTable
+
+POLL = 0.05  # Seconds between checks of the stop event while the pool searches
+
+_pool = None  # The process pool, kept across turns
+_workers = 0  # The number of processes in the pool
+_shared = None  # The best root value found so far, shared by all workers
+_cancel = None  # Set to make every worker give up its search (SearchTimeout)
+_lock = threading.Lock()  # Held by the one search using _shared and _cancel
+_tables = {}  # This stores grid size -> transposition table, per pool process
+
+
+def _init_worker(shared, cancel):
+    global _shared, _cancel
+    _shared, _cancel = shared, cancel
+
+
+def get_pool(workers=None):
+    """
+    This function returns the process pool, creating it if there is none
+    The same pool is reused for every search, so workers start only once
+    Creating it starts every process at once, so a program that forks them
+    (the default on Linux) should call this before it starts any threads:
+    forking a process while another thread holds a lock copies the lock held
+    """
+    global _pool, _workers, _shared, _cancel
+
+    if _pool is None:
+        _workers = workers or os.cpu_count()
+        _shared = multiprocessing.Value("d", 0.0)
+        _cancel = multiprocessing.Event()
+        _pool = ProcessPoolExecutor(
+            max_workers=_workers,
+            initializer=_init_worker,
+            initargs=(_shared, _cancel),
+        )
+        # The processes only start with the first task; this is that task
+        wait([_pool.submit(os.getpid) for _ in range(_workers)])
+
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def _chunks(tasks):
+    """
+    This function deals the root moves out to one chunk per worker, like
+    cards, so the first (best ordered) moves start in every worker at once
+    """
+    return [tasks[i::_workers] for i in range(min(_workers, len(tasks)))]
+
+
+def _raise_best(value):
+    """
+    This function publishes a root value (from the AI's point of view) to the
+    other workers if it is the best so far
+    """
+    with _shared.get_lock():
+        if value > _shared.value:
+            _shared.value = value
+
+
+def _run(function, chunks, args, stop=None):
+    """
+    This function searches every chunk in the pool and returns the results in
+    chunk order
+    A worker that runs out of budget raises SearchTimeout, which is raised here
+    once the other workers were told to give up too (as they are when stop is
+    set), so the pool is idle again for the next search
+    The caller holds _lock, since all searches share _shared and _cancel
+    """
+    pool = get_pool()
+    futures = [pool.submit(function, chunk, *args) for chunk in chunks]
+
+    try:
+        pending = futures
+        while pending:
+            done, pending = wait(pending, POLL, FIRST_EXCEPTION)
+            failed = any(f.exception() is not None for f in done)
+            if pending and (failed or (stop is not None and stop.is_set())):
+                _cancel.set()
+                wait(pending)
+                break
+    finally:
+        _cancel.clear()
+
+    return [f.result() for f in futures]
+
+
+def _unchunk(tasks, chunks, results):
+    """
+    This function puts the results of the chunks back in the order of tasks
+    """
+    values = [None] * len(tasks)
+    for i, chunk_values in enumerate(results):
+        values[i :: len(chunks)] = chunk_values
+
+    return values
+
+
+def _alpha_beta_root_moves(lines, state, depth, maximizing):
+    """
+    This function searches a chunk of root moves in a worker, one after the
+    other, and returns their values
+    The window starts one point below the best value any worker has found so
+    far (values are whole boxes), so ties still come back exact and the
+    parent can break them by root order exactly like the serial search
+    There is no transposition table here: an entry from a deeper search would
+    give a different value than the serial search at this depth
+    """
+    game = DotsAndBoxesGame.unpack(state)
+    ordering = MoveOrderer(game.geometry.line_count)
+    sign = 1 if maximizing else -1
+    values = []
+
+    for line in lines:
+        undo = game.play(line)
+        floor = sign * _shared.value - sign
+
+        value, _ = alpha_beta(
+            game,
+            depth - 1,
+            floor if maximizing else -float("inf"),
+            float("inf") if maximizing else floor,
+            game.current_player == Player.AI,
+            in_place=True,
+            ordering=ordering,
+        )
+        game.undo_move(undo)
+
+        _raise_best(sign * value)
+        values.append(value)
+
+    return values
+
+
+def _minimax_root_moves(lines, state, depth):
+    game = DotsAndBoxesGame.unpack(state)
+    values = []
+
+    for line in lines:
+        undo = game.play(line)
+        values.append(
+            minimax(game, depth - 1, game.current_player == Player.AI, True)[0]
+        )
+        game.undo_move(undo)
+
+    return values
+
+
+def _pick(game, moves, values, maximizing):
+    """
+    This function picks the best root move; ties go to the earliest move,
+    which is the one the serial search keeps
+    """
+    best = max(values) if maximizing else min(values)
+
+    return best, game.geometry.line_moves[moves[values.index(best)]]
+
+
+def parallel_alpha_beta(game, depth, maximizing, workers=None):
+    """
+    This function runs alpha_beta with its root moves split across the pool
+    It returns the same (value, move) as alpha_beta(game, depth, -inf, inf,
+    maximizing) does serially
+    """
+    if depth == 0 or game.is_terminal():
+        return game.evaluate(), None
+
+    # alpha_beta answers these at its root (tablebase first, then the endgame
+    # solver) without searching, so the root is handed to it as it is
+    if probe_tablebase(game) is not None or solve_endgame(game) is not None:
+        return alpha_beta(game, depth, -float("inf"), float("inf"), maximizing)
+
+    get_pool(workers)
+    moves = game.legal_lines()
+    chunks = _chunks(moves)
+    with _lock:
+        _shared.value = -float("inf")
+        results = _run(_alpha_beta_root_moves, chunks, (game.pack(), depth, maximizing))
+
+    return _pick(game, moves, _unchunk(moves, chunks, results), maximizing)
+
+
+def parallel_minimax(game, depth, maximizing, workers=None):
+    """
+    This function runs minimax with its root moves split across the pool
+    """
+    if depth == 0 or game.is_terminal():
+        return game.evaluate(), None
+
+    get_pool(workers)
+    moves = game.legal_lines()
+    chunks = _chunks(moves)
+    with _lock:
+        results = _run(_minimax_root_moves, chunks, (game.pack(), depth))
+
+    return _pick(game, moves, _unchunk(moves, chunks, results), maximizing)
+
+
+def _turn_moves(
+    tasks, states, depth, algo_choice, deadline, node_budget, with_stats=False
+):
+    """
+    This function searches a chunk of (alternative, line) root moves of the
+    AI's turn in a worker and returns (their values, nodes searched, stats)
+    stats is a SearchStats of the chunk's searches with with_stats, else None
+    Like search_turn, every line is searched from one point below the best
+    value any worker has found so far, and with "pvs" the lines after a
+    worker's first are only scouted with a null window
+    Every process keeps one table per grid size for all the turns it serves
+    deadline is a time.time() the search has to give up by, if any
+    """
+    positions = {}
+    size = states[0][0][0]
+    if size not in _tables:
+        _tables[size] = TranspositionTable(symmetric=True)
+    table = _tables[size]
+    ordering = MoveOrderer(board_geometry(size).line_count)
+    limits = SearchLimits(
+        None if deadline is None else max(0.0, deadline - time.time()),
+        node_budget,
+        _cancel,
+    )
+    stats = SearchStats() if with_stats else None
+    values = []
+
+    for i, line in tasks:
+        if i not in positions:
+            positions[i] = DotsAndBoxesGame.unpack(states[i][0])
+        position, keeps_turn = positions[i], states[i][1]
+
+        undo = position.play(line)
+        if keeps_turn and not position.is_terminal():
+            position.current_player = Player.AI
+        maximizing = position.current_player == Player.AI
+        floor = _shared.value - 1
+
+        if algo_choice == "pvs":
+            scout = bool(values)
+            value, _ = pvs(
+                position,
+                depth - 1,
+                floor,
+                floor + 1 if scout else float("inf"),
+                True,
+                table,
+                limits,
+                ordering,
+                stats=stats,
+            )
+            if scout and value > floor:
+                value, _ = pvs(
+                    position,
+                    depth - 1,
+                    value,
+                    float("inf"),
+                    True,
+                    table,
+                    limits,
+                    ordering,
+                    stats=stats,
+                )
+        elif algo_choice == "alpha-beta":
+            value, _ = alpha_beta(
+                position,
+                depth - 1,
+                floor,
+                float("inf"),
+                maximizing,
+                in_place=True,
+                table=table,
+                limits=limits,
+                ordering=ordering,
+                stats=stats,
+            )
+        else:
+            value, _ = minimax(position, depth - 1, maximizing, True, limits, stats)
+
+        position.undo_move(undo)
+
+        _raise_best(value)
+        values.append(value)
+
+    return values, limits.nodes, stats
+
+
+def parallel_search_turn(
+    alternatives,
+    depth,
+    algo_choice="alpha-beta",
+    limits=None,
+    ordering=None,
+    first=None,
+    workers=None,
+    stats=None,
+):
+    """
+    This function is ai.search_turn with the root moves of every alternative
+    split across the pool, and returns (value, power-up, move) the same way
+    Alternatives go to the workers as packed states, never as games, and each
+    worker gets one chunk of moves for the whole search
+    limits (see iterative_deepening.SearchLimits) is turned into a deadline
+    and a share of the remaining node budget for every worker, and the nodes
+    they searched are added to it; its stop event cancels the workers
+    The workers' counts are merged into stats (see search_stats.SearchStats)
+    Searches from several threads take turns on the pool, one at a time
+    """
+    get_pool(workers)
+    if stats is not None:
+        stats.node(depth)
+    order = alternatives[1:] + alternatives[:1]
+    states = [(position.pack(), keeps_turn) for _, position, keeps_turn in order]
+    tasks = []
+
+    for i, (action, position, _) in enumerate(order):
+        moves = position.legal_lines()
+        hint = first[1] if first is not None and first[0] == action else None
+        if ordering is not None:
+            moves = ordering.order(position, moves, depth, hint)
+        tasks += [(i, line) for line in moves]
+
+    chunks = _chunks(tasks)
+    deadline = node_budget = stop = None
+    if limits is not None:
+        stop = limits.stop
+        if limits.deadline is not None:
+            deadline = time.time() + limits.deadline - time.perf_counter()
+        if limits.node_budget is not None:
+            node_budget = (limits.node_budget - limits.nodes) // len(chunks)
+            if node_budget <= 0:
+                raise SearchTimeout()
+
+    with _lock:
+        _shared.value = -float("inf")
+        results = _run(
+            _turn_moves,
+            chunks,
+            (states, depth, algo_choice, deadline, node_budget, stats is not None),
+            stop,
+        )
+    if limits is not None:
+        limits.nodes += sum(nodes for _, nodes, _ in results)
+    if stats is not None:
+        for _, _, chunk_stats in results:
+            stats.merge(chunk_stats)
+    values = _unchunk(tasks, chunks, [chunk_values for chunk_values, _, _ in results])
+
+    # The best value; ties go to playing without a power-up, as in search_turn,
+    # and then to the earliest (best ordered) move
+    best = max(values)
+    tied = [k for k, value in enumerate(values) if value == best]
+    k = next((k for k in tied if order[tasks[k][0]][0] is None), tied[0])
+    action, position, _ = order[tasks[k][0]]
+
+    return best, action, position.geometry.line_moves[tasks[k][1]]
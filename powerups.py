@@ -0,0 +1,74 @@
+import random
+from constants import Player
+
+POWER_UPS = ("Extra Move", "Line Reversal", "Swap Token")
+
+
+class PowerUps:
+    """
+    This class applies the power token rules of one game, for both sides
+    The tokens themselves live on the game; this keeps the effects of a used
+    token that outlast the click (the extra line, the swapped lines)
+    The game loop and the headless self-play runner both play through it, so
+    they follow exactly the same rules
+    """
+
+    def __init__(self, rng=random):
+        self.rng = rng  # Picks the random lines of Swap Token
+        self.extra_move = False  # This stores whether the mover draws another line
+        self.swap_count = 0  # This stores how many player lines get a random reply
+
+    def can_use(self, game, player):
+        return game.power_tokens[player] >= 1 and not game.power_used_this_turn
+
+    def use(self, game, player, action):
+        """
+        This function spends the player's token on a power-up
+        It returns False (and spends nothing) if the power-up cannot be used,
+        e.g. Line Reversal when the last line is the player's own
+        """
+        if not self.can_use(game, player):
+            return False
+
+        if action == "Line Reversal":
+            if not game.last_move or game.lines.get(game.last_move) == player:
+                return False
+            del game.lines[game.last_move]
+        elif action == "Extra Move":
+            self.extra_move = True
+        elif action == "Swap Token":
+            self.swap_count = 2
+        else:
+            return False
+
+        game.power_tokens[player] = 0
+        game.power_used_this_turn = True
+
+        return True
+
+    def play(self, game, move):
+        """
+        This function draws a line for the side to move and applies the
+        effects of any power-up in play: after an Extra Move the same side
+        draws again, and while a swap is running each of the player's lines is
+        followed by a random line, with the player keeping the turn
+        It returns that random line, or None if no line was swapped in
+        """
+        mover = game.current_player
+        game.make_move(move)
+
+        if self.extra_move:
+            game.current_player = mover
+            self.extra_move = False
+
+        if mover == Player.PLAYER and self.swap_count > 0:
+            self.swap_count -= 1
+            avail = game.get_possible_moves()
+            if avail:
+                swap = self.rng.choice(avail)
+                game.make_move(swap)
+                game.current_player = Player.PLAYER
+
+                return swap
+
+        return None
@@ -0,0 +1,207 @@
+from constants import Player
+from endgame import solve as solve_endgame
+from symmetry import from_canonical, to_canonical
+from tablebase import probe as probe_tablebase
+from transposition import EXACT, LOWER, UPPER
+
+INF = float("inf")
+ASPIRATION = 2  # Half-width in boxes of the first aspiration window
+
+
+def _child(game, mover, depth, lo, hi, args):
+    """
+    This function searches the position after a line of mover's in the window
+    (lo, hi) of mover, and returns the value for mover and the variation
+    """
+    if game.current_player == mover:
+        return _search(game, depth - 1, lo, hi, *args)
+
+    value, pv = _search(game, depth - 1, -hi, -lo, *args)
+
+    return -value, pv
+
+
+def _search(game, depth, alpha, beta, table, limits, ordering, endgame, stats):
+    """
+    This function is the negamax principal variation search itself: values
+    are from the point of view of the side to move, and the window is flipped
+    only where the turn actually passes (a captured box keeps the turn)
+    It returns (value, principal variation as line indices)
+    """
+    if limits is not None:
+        limits.tick()
+    if stats is not None:
+        stats.node(depth)
+
+    mover = game.current_player
+    sign = 1 if mover == Player.AI else -1
+    score = sign * game.evaluate()
+
+    if depth == 0 or game.is_terminal():
+        return score, []
+
+    if endgame:
+        solved = probe_tablebase(game)
+        if solved is not None:
+            if stats is not None:
+                stats.tablebase += 1
+        else:
+            solved = solve_endgame(game)
+            if solved is not None and stats is not None:
+                stats.solved += 1
+
+        if solved is not None:
+            return score + solved[0], [solved[1]]
+
+    moves = game.legal_lines()
+    tt_move = None
+
+    if table is not None:
+        key, sym = table.key_of(game)
+        entry = table.probe(key)
+        if stats is not None:
+            stats.probe(entry is not None)
+
+        if entry is not None:
+            # Entries are kept from the AI's point of view, as alpha_beta
+            # stores them, so both searches can share one table
+            _, entry_depth, value, flag, tt_move, _ = entry
+            tt_move = from_canonical(game, sym, tt_move)
+
+            if entry_depth >= depth:
+                value = sign * value + score
+                if sign < 0 and flag != EXACT:
+                    flag = LOWER if flag == UPPER else UPPER
+
+                if flag == EXACT:
+                    if stats is not None:
+                        stats.table_cuts += 1
+                    return value, [tt_move]
+                if flag == LOWER:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+                if alpha >= beta:
+                    if stats is not None:
+                        stats.table_cuts += 1
+                    return value, [tt_move]
+
+        alpha_orig = alpha
+
+    if ordering is not None:
+        moves = ordering.order(game, moves, depth, tt_move)
+    elif tt_move is not None:
+        moves.remove(tt_move)
+        moves.insert(0, tt_move)
+
+    best, best_pv = -INF, []
+
+    args = (table, limits, ordering, endgame, stats)
+
+    for i, line in enumerate(moves):
+        undo = game.play(line)
+
+        if i == 0:
+            value, pv = _child(game, mover, depth, alpha, beta, args)
+        else:
+            # Scout: only prove this line is no better than the best so far
+            value, pv = _child(game, mover, depth, alpha, alpha + 1, args)
+            if alpha < value < beta:
+                value, pv = _child(game, mover, depth, value, beta, args)
+
+        game.undo_move(undo)
+
+        if value > best:
+            best, best_pv = value, [line] + pv
+        if best > alpha:
+            alpha = best
+
+        if alpha >= beta:
+            if ordering is not None:
+                ordering.record_cutoff(line, depth)
+            if stats is not None:
+                stats.cutoff(depth, i)
+            break
+
+    if table is not None:
+        if best <= alpha_orig:
+            flag = UPPER
+        elif best >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        if sign < 0 and flag != EXACT:
+            flag = LOWER if flag == UPPER else UPPER
+        table.store(
+            key,
+            depth,
+            sign * (best - score),
+            flag,
+            to_canonical(game, sym, best_pv[0]),
+        )
+
+    return best, best_pv
+
+
+def pvs(
+    game,
+    depth,
+    alpha=-INF,
+    beta=INF,
+    in_place=False,
+    table=None,
+    limits=None,
+    ordering=None,
+    endgame=True,
+    stats=None,
+):
+    """
+    This function runs a principal variation search: the first (best ordered)
+    move of every node gets the full window and the rest a null window that
+    only proves them worse, with a re-search for a move that turns out better
+    It takes and returns values from the AI's point of view, as alpha_beta
+    does, and returns (value, principal variation) where the variation is the
+    list of moves (move tuples) both sides are expected to play, best move
+    first; it ends early where the table or the endgame solver answered
+    The table, limits, ordering, endgame and stats arguments work as for
+    alpha_beta, and a table can be shared with it
+    """
+    if not in_place:
+        game = game.clone()
+
+    if game.current_player == Player.AI:
+        value, pv = _search(
+            game, depth, alpha, beta, table, limits, ordering, endgame, stats
+        )
+    else:
+        value, pv = _search(
+            game, depth, -beta, -alpha, table, limits, ordering, endgame, stats
+        )
+        value = -value
+
+    moves = game.geometry.line_moves
+
+    return value, [moves[line] for line in pv]
+
+
+def aspiration_search(game, depth, guess, window=ASPIRATION, **kwargs):
+    """
+    This function runs pvs in a narrow window around guess (usually the value
+    of the previous, shallower iteration), which cuts off more than a full
+    window would; a result on the edge of the window is only a bound, so the
+    window is widened on that side (twice as far each time) and searched again
+    It returns (value, principal variation) as pvs does
+    """
+    lo, hi = guess - window, guess + window
+
+    while True:
+        value, pv = pvs(game, depth, lo, hi, **kwargs)
+
+        if value <= lo and lo > -INF:
+            window *= 2
+            lo = guess - window if window < 64 else -INF
+        elif value >= hi and hi < INF:
+            window *= 2
+            hi = guess + window if window < 64 else INF
+        else:
+            return value, pv
@@ -0,0 +1,151 @@
+import json
+import time
+
+
+class SearchStats:
+    """
+    This class collects statistics of the searches it is passed to (the stats
+    argument of alpha_beta, minimax, iterative_deepening and ai.ai_turn)
+    Depths are remaining depths, as the searches count them: the root of a
+    depth 4 search is at depth 4 and its leaves at depth 0
+    Nothing is collected (and nothing costs more than an `is None` check) when
+    no collector is passed
+    finish() turns what was collected into a report dict, hands it to the
+    callback (e.g. a JsonlSink) and starts over for the next search
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback  # This is called with every finished report
+        self.reset()
+
+    def reset(self):
+        self.nodes = {}  # This stores depth -> nodes visited
+        self.cutoffs = {}  # This stores depth -> beta cutoffs
+        self.cutoff_moves = {}  # This stores which move (0 = first) cut off
+        self.probes = 0  # Transposition table lookups
+        self.hits = 0  # Lookups that found the position
+        self.table_cuts = 0  # Lookups that ended the node without searching
+        self.solved = 0  # Nodes answered by the endgame solver
+        self.tablebase = 0  # Nodes answered by the tablebase
+        self.iterations = []  # One (depth, nodes, seconds) per deepening step
+        self.start = self.mark = time.perf_counter()
+        self.marked_nodes = 0
+
+    def node(self, depth):
+        self.nodes[depth] = self.nodes.get(depth, 0) + 1
+
+    def cutoff(self, depth, index):
+        self.cutoffs[depth] = self.cutoffs.get(depth, 0) + 1
+        self.cutoff_moves[index] = self.cutoff_moves.get(index, 0) + 1
+
+    def probe(self, hit):
+        self.probes += 1
+        self.hits += hit
+
+    def merge(self, other):
+        """
+        This function adds what another collector counted, e.g. in a worker
+        process of parallel_search, to this one
+        """
+        for mine, theirs in (
+            (self.nodes, other.nodes),
+            (self.cutoffs, other.cutoffs),
+            (self.cutoff_moves, other.cutoff_moves),
+        ):
+            for key, count in theirs.items():
+                mine[key] = mine.get(key, 0) + count
+        self.probes += other.probes
+        self.hits += other.hits
+        self.table_cuts += other.table_cuts
+        self.solved += other.solved
+        self.tablebase += other.tablebase
+
+    def iteration(self, depth):
+        """
+        This function marks the end of one completed deepening iteration
+        """
+        now = time.perf_counter()
+        total = self.total_nodes()
+        self.iterations.append((depth, total - self.marked_nodes, now - self.mark))
+        self.mark, self.marked_nodes = now, total
+
+    def total_nodes(self):
+        return sum(self.nodes.values())
+
+    def report(self, **extra):
+        """
+        This function returns everything collected so far as a JSON-ready dict
+        The effective branching factor is nodes ** (1 / depth) of the deepest
+        search (the last iteration when deepening), and per iteration the
+        ratio of its nodes to the previous iteration's
+        """
+        total = self.total_nodes()
+        cutoffs = sum(self.cutoffs.values())
+
+        if self.iterations:
+            depth, nodes, _ = self.iterations[-1]
+        else:
+            depth, nodes = max(self.nodes, default=0), total
+
+        return {
+            **extra,
+            "nodes": total,
+            "seconds": round(time.perf_counter() - self.start, 6),
+            "nodes_per_depth": {str(d): n for d, n in sorted(self.nodes.items())},
+            "cutoffs": cutoffs,
+            "cutoffs_per_depth": {str(d): n for d, n in sorted(self.cutoffs.items())},
+            "cutoff_move_index": {
+                str(i): n for i, n in sorted(self.cutoff_moves.items())
+            },
+            "first_move_cutoff_rate": (
+                round(self.cutoff_moves.get(0, 0) / cutoffs, 4) if cutoffs else None
+            ),
+            "ebf": round(nodes ** (1 / depth), 3) if depth and nodes else None,
+            "table_hit_rate": (
+                round(self.hits / self.probes, 4) if self.probes else None
+            ),
+            "table_probes": self.probes,
+            "table_cuts": self.table_cuts,
+            "endgame_solved": self.solved,
+            "tablebase_hits": self.tablebase,
+            "iterations": [
+                {
+                    "depth": d,
+                    "nodes": n,
+                    "seconds": round(s, 6),
+                    "ebf": round(n / prev[1], 3) if i and prev[1] else None,
+                }
+                for i, ((d, n, s), prev) in enumerate(
+                    zip(self.iterations, [(0, 0, 0)] + self.iterations)
+                )
+            ],
+        }
+
+    def finish(self, **extra):
+        """
+        This function reports the search that just ended (extra fields, such as
+        the move played, are added to the report) and resets the collector
+        """
+        report = self.report(**extra)
+        if self.callback is not None:
+            self.callback(report)
+        self.reset()
+
+        return report
+
+
+class JsonlSink:
+    """
+    This class is a SearchStats callback that appends every report to a JSON
+    Lines file, one line per search
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "a")
+
+    def __call__(self, report):
+        self.file.write(json.dumps(report) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,184 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from ai import ai_turn
+from constants import Player
+from gamerecord import GameRecorder, append_record
+from logic import DotsAndBoxesGame
+from mcts import MCTS
+from powerups import PowerUps
+from transposition import TranspositionTable
+
+# Node budgets (instead of think time) keep seeded games reproducible
+DEFAULT_SIDE = {
+    "algo": "alpha-beta",
+    "depth": 2,
+    "budget": {"node_budget": 20000},
+    "ai_prob": 0.3,
+}
+
+
+def play_game(seed, size=4, sides=None, table_entries=1 << 16, record=False):
+    """
+    This function plays one AI-vs-AI game without a display and returns its
+    result as a dict
+    sides maps Player.PLAYER and Player.AI to a side's settings (algo, depth,
+    budget and ai_prob, as in DEFAULT_SIDE); both sides play by the same power
+    token rules as the game loop, and the player's side is searched on the
+    game with the two sides swapped
+    The game only depends on seed, unless a side has a time budget
+    With record, the result also holds the encoded game record (see gamerecord)
+    """
+    random.seed(seed)
+    sides = sides or {Player.PLAYER: DEFAULT_SIDE, Player.AI: DEFAULT_SIDE}
+    tables = {
+        player: TranspositionTable(max_entries=table_entries, symmetric=True)
+        for player in sides
+    }  # One per side, since a table stores values from its side's point of view
+    engines = {
+        player: MCTS(seed=seed)
+        for player, side in sides.items()
+        if side["algo"] == "mcts"
+    }  # MCTS sides keep their tree from turn to turn
+    game = DotsAndBoxesGame(size)
+    game.current_player = random.choice([Player.PLAYER, Player.AI])
+    rules = PowerUps()
+    first = game.current_player
+    turns = 0
+    power_ups = {Player.PLAYER: {}, Player.AI: {}}
+    think = {Player.PLAYER: 0.0, Player.AI: 0.0}
+    recorder = GameRecorder(game) if record else None
+
+    while not game.is_terminal():
+        player = game.current_player
+        side = sides[player]
+        view = game if player == Player.AI else game.swap_sides()
+        start = time.perf_counter()
+        action, move = ai_turn(
+            view,
+            side["algo"],
+            side["depth"],
+            side["budget"],
+            side["ai_prob"],
+            tables[player],
+            engine=engines.get(player),
+        )
+        think[player] += time.perf_counter() - start
+
+        if action is not None and rules.use(game, player, action):
+            power_ups[player][action] = power_ups[player].get(action, 0) + 1
+            if recorder is not None:
+                recorder.use(action)
+
+        swap = rules.play(game, move)
+        if recorder is not None:
+            recorder.play(game, move, swap)
+        turns += 1
+
+    res = game.evaluate()
+    result = {
+        "seed": seed,
+        "size": size,
+        "first": first.name.lower(),
+        "winner": "ai" if res > 0 else "player" if res < 0 else "tie",
+        "score": {"player": game.player_score, "ai": game.ai_score},
+        "turns": turns,
+        "power_ups": {p.name.lower(): used for p, used in power_ups.items()},
+        "think_time": {p.name.lower(): round(t, 4) for p, t in think.items()},
+    }
+    if recorder is not None:
+        result["record"] = recorder.finish(game)
+
+    return result
+
+
+def run_games(seeds, size=4, sides=None, workers=None, record=False):
+    """
+    This function plays a game for every seed across a process pool and
+    yields the results as the games finish (not in seed order)
+    """
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [
+            pool.submit(play_game, seed, size, sides, record=record) for seed in seeds
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def _side(args, name):
+    budget = {}
+    if getattr(args, name + "_nodes") is not None:
+        budget["node_budget"] = getattr(args, name + "_nodes")
+    if getattr(args, name + "_time") is not None:
+        budget["time_budget"] = getattr(args, name + "_time")
+    if not budget:
+        budget["max_depth"] = getattr(args, name + "_depth")
+
+    return {
+        "algo": getattr(args, name + "_algo"),
+        "depth": getattr(args, name + "_depth"),
+        "budget": budget,
+        "ai_prob": getattr(args, name + "_prob"),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Play seeded AI-vs-AI games headlessly across all cores "
+        "and stream one JSON result per game"
+    )
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first game")
+    parser.add_argument("--size", type=int, default=4, help="dots per side")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out", default="-", help="JSONL file (- for stdout)")
+    parser.add_argument(
+        "--record", metavar="FILE", help="also append every game to a record archive"
+    )
+
+    for name in ("player", "ai"):
+        parser.add_argument(
+            f"--{name}-algo",
+            choices=("alpha-beta", "pvs", "minimax", "mcts"),
+            default="alpha-beta",
+        )
+        parser.add_argument(f"--{name}-depth", type=int, default=2)
+        parser.add_argument(f"--{name}-nodes", type=int, default=None)
+        parser.add_argument(f"--{name}-time", type=float, default=None)
+        parser.add_argument(f"--{name}-prob", type=float, default=0.3)
+
+    args = parser.parse_args(argv)
+    sides = {Player.PLAYER: _side(args, "player"), Player.AI: _side(args, "ai")}
+    seeds = range(args.seed, args.seed + args.games)
+    out = sys.stdout if args.out == "-" else open(args.out, "w")
+    wins = {"player": 0, "ai": 0, "tie": 0}
+    start = time.perf_counter()
+
+    try:
+        for result in run_games(
+            seeds, args.size, sides, args.workers, args.record is not None
+        ):
+            record = result.pop("record", None)
+            if record is not None:
+                append_record(args.record, record)
+            wins[result["winner"]] += 1
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"{args.games} games in {elapsed:.1f}s ({args.games / elapsed:.1f} games/s): "
+        f"player {wins['player']}, ai {wins['ai']}, tie {wins['tie']}",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,478 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import count
+from ai import SWAP_SHARE, ai_turn
+from ai_worker import likely_moves
+from constants import Player
+from gamerecord import GameRecorder, append_record
+from logic import DotsAndBoxesGame
+from opening_book import OpeningBook
+from powerups import POWER_UPS, PowerUps
+from transposition import TranspositionTable
+
+# The search budget of every difficulty: node budgets instead of think time, so
+# the AI is as strong on a busy server as on an idle one, until the AI deadline
+# (which every search also gets as a time budget) cuts a search short
+DIFFICULTIES = {
+    "Easy": ({"node_budget": 2000}, 0.1),
+    "Medium": ({"node_budget": 10000}, 0.3),
+    "Hard": ({"node_budget": 50000}, 0.5),
+}  # difficulty -> (alpha-beta budget, chance of the AI using its power token)
+MOVE_TIMEOUT = 60.0  # Seconds the player has for a move before forfeiting
+AI_TIMEOUT = 5.0  # Seconds the AI has for a move (pool queue included)
+AI_SEARCH_SHARE = 0.8  # Share of that the search may use; the rest covers the trip back
+SAMPLES = 10000  # Latencies kept per metric for the percentiles
+
+_tables = {}  # This stores grid size -> transposition table, per pool process
+
+
+def _decide(state, budget, ai_prob, deadline, seed):
+    """
+    This function runs in a pool process and decides the AI's turn of a packed
+    game (see DotsAndBoxesGame.pack), returning (power-up, line index)
+    The search also gets the time left until deadline (a time.time(), so time
+    spent waiting for a free process counts) as its time budget; it stops on
+    its own and plays its best move so far, instead of holding the process
+    after the server has given up on it
+    seed makes the random choices (power token use, Swap Token outcomes) the
+    session's own: forked processes would otherwise all roll the same ones
+    Every process keeps one table per grid size for all the sessions it serves
+    """
+    random.seed(seed)
+    game = DotsAndBoxesGame.unpack(state)
+    if game.size not in _tables:
+        _tables[game.size] = TranspositionTable(symmetric=True)
+
+    # Swap Token sampling gets SWAP_SHARE of the budget on top of the search
+    left = max(0.0, deadline - time.time()) / (1 + SWAP_SHARE)
+    budget = {**budget, "time_budget": left}
+    action, move = ai_turn(game, "alpha-beta", 2, budget, ai_prob, _tables[game.size])
+
+    return action, game.geometry.line_index[move]
+
+
+class LatencyStats:
+    """
+    This class keeps the most recent latencies of one kind and sums up them
+    all: count, mean over everything, percentiles over the recent ones
+    """
+
+    def __init__(self, samples=SAMPLES):
+        self.recent = deque(maxlen=samples)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        self.recent.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0}
+
+        ordered = sorted(self.recent)
+
+        def percentile(p):
+            return round(
+                ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 3
+            )
+
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 3),
+            "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(ordered[-1] * 1000, 3),
+        }
+
+
+class ServerMetrics:
+    """
+    This class counts what the server does and times it: every request from
+    receiving it to sending its reply, and every AI move from handing it to the
+    pool to getting it back (time waiting for a free process included)
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.connections = 0  # Open right now
+        self.sessions = 0  # Games started
+        self.finished = 0  # Games played to the end
+        self.forfeits = 0  # Games lost on the player's move deadline
+        self.ai_fallbacks = 0  # AI moves that missed their deadline
+        self.book_moves = 0  # AI moves answered by an opening book
+        self.errors = 0  # Requests answered with an error
+        self.requests = LatencyStats()
+        self.ai_moves = LatencyStats()
+
+    def snapshot(self):
+        uptime = time.perf_counter() - self.start
+
+        return {
+            "uptime": round(uptime, 3),
+            "connections": self.connections,
+            "sessions": self.sessions,
+            "finished": self.finished,
+            "forfeits": self.forfeits,
+            "ai_fallbacks": self.ai_fallbacks,
+            "book_moves": self.book_moves,
+            "errors": self.errors,
+            "requests_per_sec": round(self.requests.count / uptime, 1),
+            "ai_moves_per_sec": round(self.ai_moves.count / uptime, 1),
+            "request_latency": self.requests.summary(),
+            "ai_latency": self.ai_moves.summary(),
+        }
+
+
+class Session:
+    """
+    This class is one game hosted by the server, against one connection
+    deadline is the event loop time the player has to move by, while it is
+    their turn (None otherwise)
+    """
+
+    def __init__(self, session_id, size, difficulty, first, recorder=None):
+        self.id = session_id
+        self.game = DotsAndBoxesGame(size)
+        self.game.current_player = first
+        self.rules = PowerUps()  # This applies the power token rules for both sides
+        self.budget, self.ai_prob = DIFFICULTIES[difficulty]
+        self.recorder = recorder  # Set when the server keeps game records
+        self.forfeited = False
+        self.deadline = None
+
+    def over(self):
+        return self.forfeited or self.game.is_terminal()
+
+    def state(self, events=()):
+        """
+        This function returns what a client sees of the game after a request:
+        events are the lines and power-ups played since its last move
+        """
+        game = self.game
+        state = {
+            "session": self.id,
+            "turn": game.current_player.name.lower(),
+            "free": game.free_lines,
+            "score": {"player": game.player_score, "ai": game.ai_score},
+            "tokens": {p.name.lower(): n for p, n in game.power_tokens.items()},
+            "events": list(events),
+            "over": self.over(),
+        }
+
+        if self.over():
+            res = game.evaluate()
+            state["winner"] = (
+                "ai" if self.forfeited or res > 0 else "player" if res < 0 else "tie"
+            )
+
+        return state
+
+
+class GameServer:
+    """
+    This class hosts many games at once on one asyncio event loop
+    Clients speak newline-delimited JSON over TCP, one request and one reply
+    per line, and play one game at a time per connection:
+      {"op": "new", "size": 4, "difficulty": "Medium", "first": "player"}
+      {"op": "move", "line": 7}            (a line index, as in "free")
+      {"op": "power", "action": "Extra Move"}
+      {"op": "state"}, {"op": "metrics"}
+    Every reply has "ok" and either the game state or an "error"
+    The AI's searches run in a process pool, so the event loop only ever does
+    the cheap work (parsing, rules, book lookups) and stays responsive
+    """
+
+    def __init__(
+        self,
+        workers=None,
+        move_timeout=MOVE_TIMEOUT,
+        ai_timeout=AI_TIMEOUT,
+        record=None,
+    ):
+        self.pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+        self.move_timeout = move_timeout
+        self.ai_timeout = ai_timeout
+        self.record = record  # The game record archive, if any
+        self.metrics = ServerMetrics()
+        self.books = {}  # This stores grid size -> OpeningBook (or None)
+        self.ids = count(1)
+
+    def book(self, size):
+        if size not in self.books:
+            self.books[size] = OpeningBook.load(size)
+
+        return self.books[size]
+
+    async def handle(self, reader, writer):
+        """
+        This function serves one connection until it closes
+        While it is the player's turn, reading the next request waits only
+        until their deadline; past it the game is forfeited
+        """
+        loop = asyncio.get_running_loop()
+        session = None
+        self.metrics.connections += 1
+
+        try:
+            while True:
+                timeout = None
+                if session is not None and session.deadline is not None:
+                    timeout = max(0.0, session.deadline - loop.time())
+
+                try:
+                    line = await asyncio.wait_for(reader.readline(), timeout)
+                except asyncio.TimeoutError:
+                    self._finish(session, forfeit=True)
+                    reply = {"ok": False, "error": "move deadline passed"}
+                    reply["state"] = session.state()
+                    await self._send(writer, reply)
+                    continue
+
+                if not line:
+                    return
+
+                start = time.perf_counter()
+                try:
+                    request = json.loads(line)
+                    session, reply = await self.dispatch(session, request)
+                except Exception as e:
+                    # A request dispatch did not foresee still only fails itself
+                    reply = {"ok": False, "error": str(e) or type(e).__name__}
+
+                if not reply["ok"]:
+                    self.metrics.errors += 1
+                await self._send(writer, reply)
+                self.metrics.requests.add(time.perf_counter() - start)
+        except (ConnectionError, ValueError):
+            pass  # The client went away, or sent a line over the size limit
+        finally:
+            self.metrics.connections -= 1
+            writer.close()
+
+    async def _send(self, writer, reply):
+        writer.write(json.dumps(reply).encode() + b"\n")
+        await writer.drain()
+
+    async def dispatch(self, session, request):
+        """
+        This function answers one request and returns (session, reply), the
+        session being the connection's game from then on
+        A malformed request raises ValueError (or KeyError for a missing field)
+        """
+        if not isinstance(request, dict):
+            raise ValueError("a request must be a JSON object")
+        op = request["op"]
+
+        if op == "metrics":
+            return session, {"ok": True, "metrics": self.metrics.snapshot()}
+
+        if op == "new":
+            size = int(request.get("size", 4))
+            difficulty = request.get("difficulty", "Medium")
+            if not 2 <= size <= 20:
+                raise ValueError("size must be between 2 and 20")
+            if difficulty not in DIFFICULTIES:
+                raise ValueError(f"unknown difficulty {difficulty!r}")
+
+            first = request.get("first")
+            if first and (
+                not isinstance(first, str) or first.upper() not in Player.__members__
+            ):
+                raise ValueError("first must be 'player' or 'ai'")
+            first = (
+                Player[first.upper()]
+                if first
+                else random.choice([Player.PLAYER, Player.AI])
+            )
+            session = Session(next(self.ids), size, difficulty, first)
+            if self.record is not None:
+                session.recorder = GameRecorder(session.game)
+            self.metrics.sessions += 1
+
+            state = session.state(await self.ai_turns(session))
+            state["lines"] = session.game.geometry.line_moves
+
+            return session, {"ok": True, **state}
+
+        if session is None:
+            raise ValueError("no game, start one with the new op")
+        if op == "state":
+            return session, {"ok": True, **session.state()}
+        if session.over():
+            raise ValueError("the game is over")
+        if session.game.current_player != Player.PLAYER:
+            raise ValueError("it is not the player's turn")
+
+        game = session.game
+        if op == "power":
+            action = request["action"]
+            if action not in POWER_UPS:
+                raise ValueError(f"unknown power-up {action!r}")
+            if not session.rules.use(game, Player.PLAYER, action):
+                raise ValueError(f"{action} cannot be used now")
+            if session.recorder is not None:
+                session.recorder.use(action)
+
+            return session, {"ok": True, **session.state()}
+
+        if op == "move":
+            line = request["line"]
+            if type(line) is not int:
+                raise ValueError("line must be a line index")
+            if line not in game.free_lines:
+                raise ValueError(f"line {line} is not free")
+            events = self._play(session, Player.PLAYER, game.geometry.line_moves[line])
+            events += await self.ai_turns(session)
+
+            return session, {"ok": True, **session.state(events)}
+
+        raise ValueError(f"unknown op {op!r}")
+
+    def _play(self, session, player, move):
+        """
+        This function draws a line through the session's rules and returns the
+        events it made (the line, and a swapped-in random line)
+        """
+        geo = session.game.geometry
+        swap = session.rules.play(session.game, move)
+        if session.recorder is not None:
+            session.recorder.play(session.game, move, swap)
+
+        events = [{"by": player.name.lower(), "line": geo.line_index[move]}]
+        if swap is not None:
+            events.append({"by": "swap", "line": geo.line_index[swap]})
+
+        return events
+
+    async def ai_turns(self, session):
+        """
+        This function plays the AI's lines for as long as it has the turn and
+        returns their events; then the player's move deadline starts
+        The search stops by itself at its share of the AI's deadline with its
+        best move so far; one that still misses the deadline (e.g. stuck
+        waiting for a free process) is dropped for a quick move that takes a
+        box if it can and otherwise gives none away if it can
+        """
+        loop = asyncio.get_running_loop()
+        game = session.game
+        events = []
+
+        while game.current_player == Player.AI and not game.is_terminal():
+            book = self.book(game.size)
+            move = book.lookup(game) if book is not None else None
+            action = None
+
+            if move is not None:
+                self.metrics.book_moves += 1
+            else:
+                start = time.perf_counter()
+                try:
+                    action, line = await asyncio.wait_for(
+                        loop.run_in_executor(
+                            self.pool,
+                            _decide,
+                            game.pack(),
+                            session.budget,
+                            session.ai_prob,
+                            time.time() + self.ai_timeout * AI_SEARCH_SHARE,
+                            random.getrandbits(64),
+                        ),
+                        self.ai_timeout,
+                    )
+                except asyncio.TimeoutError:
+                    self.metrics.ai_fallbacks += 1
+                    line = likely_moves(game, 1)[0]
+                self.metrics.ai_moves.add(time.perf_counter() - start)
+                move = game.geometry.line_moves[line]
+
+            if action is not None and session.rules.use(game, Player.AI, action):
+                events.append({"by": "ai", "power": action})
+                if session.recorder is not None:
+                    session.recorder.use(action)
+
+            events += self._play(session, Player.AI, move)
+
+        if game.is_terminal():
+            self._finish(session)
+        else:
+            session.deadline = loop.time() + self.move_timeout
+
+        return events
+
+    def _finish(self, session, forfeit=False):
+        session.deadline = None
+        session.forfeited = forfeit
+        if forfeit:
+            self.metrics.forfeits += 1
+        else:
+            self.metrics.finished += 1
+            if session.recorder is not None:
+                append_record(self.record, session.recorder.finish(session.game))
+
+    async def report(self, every, out):
+        """
+        This function writes a metrics snapshot as a JSON line every few seconds
+        """
+        while True:
+            await asyncio.sleep(every)
+            out.write(json.dumps(self.metrics.snapshot()) + "\n")
+            out.flush()
+
+    async def serve(self, host, port, metrics_every=None):
+        server = await asyncio.start_server(self.handle, host, port, limit=1 << 16)
+        if metrics_every:
+            asyncio.get_running_loop().create_task(
+                self.report(metrics_every, sys.stderr)
+            )
+
+        print(f"serving on {host}:{port}", file=sys.stderr)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Host many games against the AI at once over a local "
+        "newline-delimited JSON protocol"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None, help="search processes")
+    parser.add_argument("--move-timeout", type=float, default=MOVE_TIMEOUT)
+    parser.add_argument("--ai-timeout", type=float, default=AI_TIMEOUT)
+    parser.add_argument(
+        "--metrics-every",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="write a metrics snapshot to stderr this often",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="FILE",
+        help="append every finished game to a record archive",
+    )
+    args = parser.parse_args(argv)
+
+    server = GameServer(args.workers, args.move_timeout, args.ai_timeout, args.record)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.metrics_every))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+from logic import iter_bits
+
+# INVERSE[t] undoes symmetry t (the two quarter turns undo each other)
+INVERSE = (0, 1, 2, 3, 4, 6, 5, 7)
+
+KEY_BITS = 64
+KEY_MASK = (1 << KEY_BITS) - 1
+
+
+def symmetric_hashes(game):
+    """
+    This function returns the Zobrist hash of the drawn lines of each of the 8
+    orientations of the board (index 0 is the board as it is)
+    """
+    return tuple(game.line_hash >> (KEY_BITS * t) & KEY_MASK for t in range(8))
+
+
+def canonical_hash(game):
+    """
+    This function returns (key, t): the Zobrist hash of the canonical orientation
+    of the position, and the symmetry t that turns the board into it
+    Every rotated or mirrored copy of a position gets the same key
+    """
+    hashes = symmetric_hashes(game)
+    t = min(range(8), key=hashes.__getitem__)
+
+    return game.zobrist_hash() ^ hashes[0] ^ hashes[t], t
+
+
+def to_canonical(game, t, line):
+    """
+    This function maps a line index into the canonical orientation
+    """
+    return game.geometry.line_perms[t][line]
+
+
+def from_canonical(game, t, line):
+    """
+    This function maps a line index from the canonical orientation back onto
+    the board, e.g. a best move read from a cache or an opening book
+    """
+    return game.geometry.line_perms[INVERSE[t]][line]
+
+
+def _permute(bits, perm):
+    result = 0
+    for i in iter_bits(bits):
+        result |= 1 << perm[i]
+
+    return result
+
+
+def transform_game(game, t):
+    """
+    This function returns a copy of the game with symmetry t applied to it
+    """
+    geo = game.geometry
+    lines, boxes = geo.line_perms[t], geo.box_perms[t]
+    new_game = game.clone()
+    new_game.drawn = _permute(game.drawn, lines)
+    new_game.ai_lines = _permute(game.ai_lines, lines)
+    new_game.claimed = _permute(game.claimed, boxes)
+    new_game.ai_boxes = _permute(game.ai_boxes, boxes)
+    new_game.rebuild_indexes()
+
+    if game.last_move is not None:
+        new_game.last_move = geo.line_moves[lines[geo.line_index[game.last_move]]]
+
+    return new_game
+
+
+def canonicalize(game):
+    """
+    This function returns (canonical game, t), the position turned into its
+    canonical orientation by symmetry t; moves found for the canonical game are
+    mapped back with from_canonical
+    """
+    _, t = canonical_hash(game)
+
+    return transform_game(game, t), t
@@ -0,0 +1,305 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from logic import board_geometry
+
+TABLEBASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tablebases")
+# Default coverage: positions with at most this many free lines, per grid size
+FREE_LINES = {3: 12, 4: 10, 5: 6}
+RECHECK = 1.0  # Seconds before looking again for a tablebase that was missing
+
+# File layout: a header, then one signed byte per position (the value) and one
+# little-endian uint16 per position (the best line), each array indexed by
+# the perfect hash of the position's free lines (see TablebaseIndex)
+# A value is what the side to move gains from here on: its boxes minus the
+# opponent's, with both sides playing perfectly
+MAGIC = b"DOTTB001"
+HEADER = struct.Struct("<8sHHQ")  # magic, grid size, max free lines, positions
+MOVE = struct.Struct("<H")
+NO_MOVE = 0xFFFF  # The best line of a position with no free lines
+
+
+class TablebaseIndex:
+    """
+    This class numbers every set of at most max_free free lines of a grid,
+    without gaps or collisions
+    Sets with fewer free lines come first; within a size k, a set of lines
+    c_0 < c_1 < ... < c_k-1 is at C(c_0, 1) + C(c_1, 2) + ... + C(c_k-1, k)
+    (its rank in the combinatorial number system), so all the sets whose
+    highest line is m sit together, right after those below m
+    """
+
+    def __init__(self, line_count, max_free):
+        self.line_count = line_count
+        self.max_free = max_free
+        self.binom = [[0] * (max_free + 2) for _ in range(line_count + 1)]
+        for n in range(line_count + 1):
+            self.binom[n][0] = 1
+            for k in range(1, min(n, max_free + 1) + 1):
+                self.binom[n][k] = self.binom[n - 1][k - 1] + self.binom[n - 1][k]
+
+        self.base = [0]  # Index of the first set with k free lines
+        for k in range(max_free + 1):
+            self.base.append(self.base[-1] + self.binom[line_count][k])
+        self.size = self.base[-1]
+
+    def rank(self, lines):
+        """
+        This function returns the index of a sorted list of free lines
+        """
+        binom = self.binom
+
+        return self.base[len(lines)] + sum(
+            binom[line][i + 1] for i, line in enumerate(lines)
+        )
+
+
+def tablebase_path(size, directory=TABLEBASE_DIR):
+    return os.path.join(directory, f"tablebase_{size}.bin")
+
+
+def _solve_block(path, size, k, top):
+    """
+    This function solves every position with k free lines, the highest of
+    them being top, from the solved positions with k - 1 free lines in the
+    file, and returns (first index, values, best lines) of the block
+    """
+    geo = board_geometry(size)
+    line_boxes, box_masks = geo.line_boxes, geo.box_line_masks
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        _, _, max_free, positions = HEADER.unpack_from(m, 0)
+        index = TablebaseIndex(geo.line_count, max_free)
+        binom = index.binom
+        values = memoryview(m)[HEADER.size : HEADER.size + positions].cast("b")
+        start = index.base[k] + binom[top][k]
+        count = binom[top][k - 1]
+        block_values = array("b", bytes(count))
+        block_moves = array("H", bytes(2 * count))
+        child_base = index.base[k - 1]
+
+        try:
+            for rest in combinations(range(top), k - 1):
+                lines = rest + (top,)
+                free = 0
+                for line in lines:
+                    free |= 1 << line
+
+                # The index of the set without lines[j] is the ranks of the
+                # lines below j as they are, and of those above one place down
+                below = [0] * k
+                for j in range(1, k):
+                    below[j] = below[j - 1] + binom[lines[j - 1]][j]
+                above = 0
+                best, best_line, rank = -128, NO_MOVE, 0
+
+                for j in range(k - 1, -1, -1):
+                    line = lines[j]
+                    rank += binom[line][j + 1]
+                    child = values[child_base + below[j] + above]
+                    above += binom[line][j]
+
+                    captured = 0
+                    for b in line_boxes[line]:
+                        if box_masks[b] & free == 1 << line:
+                            captured += 1
+
+                    value = captured + child if captured else -child
+                    if value > best:
+                        best, best_line = value, line
+
+                block_values[rank - binom[top][k]] = best
+                block_moves[rank - binom[top][k]] = best_line
+        finally:
+            values.release()
+
+    if sys.byteorder != "little":
+        block_moves.byteswap()
+
+    return start, block_values.tobytes(), block_moves.tobytes()
+
+
+def build_tablebase(size, max_free, directory=TABLEBASE_DIR, workers=None, log=None):
+    """
+    This function retrograde-solves every position of a grid size with at most
+    max_free free lines and writes them to the size's tablebase file
+    Positions are solved in rounds of one more free line, each round from the
+    previous one's values in the file; a round is split by its highest free
+    line into blocks that the process pool solves in parallel
+    Only the drawn lines matter: boxes already captured do not change what is
+    left to win, so one entry covers every score and every owner of the lines
+    """
+    geo = board_geometry(size)
+    max_free = min(max_free, geo.line_count)
+    index = TablebaseIndex(geo.line_count, max_free)
+    path = tablebase_path(size, directory)
+    moves_at = HEADER.size + index.size
+
+    os.makedirs(directory, exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, size, max_free, index.size))
+        f.truncate(moves_at + 2 * index.size)
+        f.seek(moves_at)
+        f.write(MOVE.pack(NO_MOVE))  # The full board: nothing left to play
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool, open(
+        path, "r+b"
+    ) as f:
+        for k in range(1, max_free + 1):
+            start = time.perf_counter()
+            blocks = [
+                pool.submit(_solve_block, path, size, k, top)
+                for top in range(k - 1, geo.line_count)
+            ]
+
+            # Every block of the round is written before the next round reads them
+            for block in blocks:
+                first, block_values, block_moves = block.result()
+                f.seek(HEADER.size + first)
+                f.write(block_values)
+                f.seek(moves_at + 2 * first)
+                f.write(block_moves)
+            f.flush()
+
+            if log is not None:
+                log(
+                    f"size {size}: {index.binom[geo.line_count][k]} positions with "
+                    f"{k} free lines in {time.perf_counter() - start:.1f}s"
+                )
+
+    return path
+
+
+class Tablebase:
+    """
+    This class reads a tablebase file through mmap
+    probe() answers any position with at most max_free free lines exactly, in
+    the time it takes to hash its free lines
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.size, self.max_free, positions = HEADER.unpack_from(self.data, 0)
+
+        if magic != MAGIC:
+            self.data.close()
+            self.file.close()
+            raise ValueError(f"{path} is not a tablebase")
+
+        self.index = TablebaseIndex(board_geometry(self.size).line_count, self.max_free)
+        self.values = memoryview(self.data)[HEADER.size : HEADER.size + positions]
+        self.values = self.values.cast("b")
+        self.moves_at = HEADER.size + positions
+
+    @classmethod
+    def load(cls, size, directory=TABLEBASE_DIR):
+        """
+        This function opens the tablebase of a grid size, or returns None if
+        there is none
+        """
+        path = tablebase_path(size, directory)
+
+        return cls(path) if os.path.exists(path) else None
+
+    def probe(self, game):
+        """
+        This function returns (value, best line) for the side to move, as
+        endgame.solve does, or None if the position is not covered
+        A position where Line Reversal took back a side of a captured box is
+        not covered either: redrawing that line captures nothing
+        """
+        lines = game.free_lines
+        if len(lines) > self.max_free:
+            return None
+
+        line_boxes = game.geometry.line_boxes
+        for line in lines:
+            for b in line_boxes[line]:
+                if game.claimed >> b & 1:
+                    return None
+
+        i = self.index.rank(lines)
+        (line,) = MOVE.unpack_from(self.data, self.moves_at + 2 * i)
+
+        return self.values[i], line
+
+    def close(self):
+        self.values.release()
+        self.data.close()
+        self.file.close()
+
+
+_tablebases = {}  # This stores grid size -> opened tablebase
+_missing = {}  # This stores grid size -> when its tablebase was last looked for
+
+
+def _tablebase(size):
+    """
+    This function returns the opened tablebase of a grid size, or None
+    A missing tablebase is looked for again every RECHECK seconds rather than
+    on every probe, so one built while the program runs is still picked up
+    """
+    tablebase = _tablebases.get(size)
+    if tablebase is not None:
+        return tablebase
+
+    now = time.monotonic()
+    if now - _missing.get(size, -RECHECK) < RECHECK:
+        return None
+
+    tablebase = Tablebase.load(size)
+    if tablebase is None:
+        _missing[size] = now
+    else:
+        _tablebases[size] = tablebase
+        _missing.pop(size, None)
+
+    return tablebase
+
+
+def probe(game):
+    """
+    This function probes the tablebase of the game's grid size, if one was
+    built; see Tablebase.probe
+    """
+    tablebase = _tablebase(game.size)
+
+    return tablebase.probe(game) if tablebase is not None else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Retrograde-solve every position with few free lines for "
+        "some grid sizes and write one tablebase file per size"
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=sorted(FREE_LINES))
+    parser.add_argument(
+        "--free", type=int, default=None, help="max free lines (default per size)"
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--dir", default=TABLEBASE_DIR)
+    args = parser.parse_args(argv)
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    for size in args.sizes:
+        start = time.perf_counter()
+        max_free = args.free if args.free is not None else FREE_LINES.get(size, 6)
+        path = build_tablebase(size, max_free, args.dir, args.workers, log)
+        print(
+            f"{path}: {os.path.getsize(path)} bytes in "
+            f"{time.perf_counter() - start:.1f}s",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
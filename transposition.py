@@ -0,0 +1,92 @@
+from symmetry import canonical_hash
+
+EXACT = 0  # The stored value is the true value of the position
+LOWER = 1  # The search failed high, the true value is at least the stored value
+UPPER = 2  # The search failed low, the true value is at most the stored value
+
+# Rough size of one stored entry (the tuple plus its ints), used for memory caps
+ENTRY_BYTES = 160
+
+
+class TranspositionTable:
+    """
+    This class stores searched positions by their Zobrist hash
+    Every slot has two entries: a depth-preferred one that keeps the deepest
+    search seen in this slot, and an always-replace one for everything else,
+    so the table never grows past its cap however long the session lasts
+    A symmetric table keys positions by their canonical orientation, so all 8
+    rotations/mirrors of a position share one entry; its moves are then stored
+    in the canonical orientation (see symmetry.from_canonical)
+    """
+
+    def __init__(self, max_entries=1 << 18, max_bytes=None, symmetric=False):
+        if max_bytes is not None:
+            max_entries = min(max_entries, max_bytes // ENTRY_BYTES)
+
+        self.slots = max(1, max_entries // 2)  # Two entries per slot
+        self.deep = [None] * self.slots  # Depth-preferred entries
+        self.recent = [None] * self.slots  # Always-replace entries
+        self.generation = 0  # Bumped per search so old deep entries can be evicted
+        self.symmetric = symmetric
+        self.probes = 0
+        self.hits = 0
+
+    def new_search(self):
+        """
+        This function marks the start of a new search (a new AI turn)
+        Deep entries from older searches may then be replaced by shallower ones
+        """
+        self.generation += 1
+
+    def clear(self):
+        self.deep = [None] * self.slots
+        self.recent = [None] * self.slots
+        self.probes = self.hits = 0
+
+    def key_of(self, game):
+        """
+        This function returns (key, t) for a position: its hash, and the
+        symmetry that maps it onto the orientation its entry is stored in
+        """
+        if self.symmetric:
+            return canonical_hash(game)
+
+        return game.zobrist_hash(), 0
+
+    def probe(self, key):
+        """
+        This function returns the entry (key, depth, value, flag, move, generation)
+        for a position, or None if it is not stored
+        """
+        self.probes += 1
+        i = key % self.slots
+        entry = self.deep[i]
+
+        if entry is None or entry[0] != key:
+            entry = self.recent[i]
+            if entry is None or entry[0] != key:
+                return None
+
+        self.hits += 1
+
+        return entry
+
+    def store(self, key, depth, value, flag, move):
+        i = key % self.slots
+        entry = (key, depth, value, flag, move, self.generation)
+        deep = self.deep[i]
+
+        if (
+            deep is None
+            or deep[0] == key
+            or depth >= deep[1]
+            or deep[5] != self.generation
+        ):
+            self.deep[i] = entry
+        else:
+            self.recent[i] = entry
+
+    def __len__(self):
+        return sum(e is not None for e in self.deep) + sum(
+            e is not None for e in self.recent
+        )